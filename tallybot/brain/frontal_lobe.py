@@ -4,7 +4,7 @@ from html.parser import HTMLParser
 import os
 import uuid
 
-from .. import memories, handlers, exchange
+from .. import memories, handlers, exchange, sql
 from ..lookups import get_partner
 
 
@@ -71,19 +71,53 @@ class Functions():
 
         Otherwise raises Exception.
         """
-        date = datetime.date(date.year, date.month, date.day)
+        return self.exchange_rates([(date, pair)])[0]
+
+    def exchange_rates(self, pairs):
+        """Give Currency rates for list of (date, pair) in its order.
+
+        Stored rates are read in one query, missing ones are resolved
+        together by RateStore and saved in one write.
+        """
+        pairs = [(datetime.date(i.year, i.month, i.day), j) for i, j in pairs]
+        if not pairs:
+            return []
         now_date = datetime.date.today()
         msg = "Rates are not available, as requested "
+        date = max(i for i, _ in pairs)
         if date > now_date:
             msg += f"{date} is in future"
             raise RuntimeWarning(msg)
-        currency = self.memory.get.currency(date=date, currency=pair)
-        if currency:
-            return currency
-        rate = exchange.get_rate(pair, date)
-        currency = memories.Currency(*(date, pair, rate))
-        self.memory.put(currency)
-        return currency
+        known = {}
+        table = sql.get_table(self.memory, memories.Currency)
+        if table is not None:
+            col = table.c
+            items = sql.select(
+                self.memory,
+                memories.Currency,
+                col.currency.in_({i for _, i in pairs}),
+                col.date >= min(i for i, _ in pairs),
+                col.date <= date,
+            )
+            known = {(i.date, i.currency): i for i in items}
+        missing = list(dict.fromkeys(i for i in pairs if i not in known))
+        if missing:
+            store = exchange.RateStore(
+                self.memory, self.conf.get("exchange_rates")
+            )
+            rates = store.get_rates(missing)
+            items = [
+                memories.Currency(*i, rate) for i, rate in zip(missing, rates)
+            ]
+            sql.put_many(self.memory, items)
+            if table is None:
+                sql.create_indexes(
+                    self.memory,
+                    memories.Currency,
+                    memories.indexes[memories.Currency],
+                )
+            known.update(((i.date, i.currency), i) for i in items)
+        return [known[i] for i in pairs]
 
     def make_expense_booking(self, expense):
         """Do expense transaction."""
@@ -95,11 +129,11 @@ class Functions():
                 raise RuntimeWarning("Expense account must start with '7'")
             book_type += expense["expense_account"]
         split_expense = False
+        total = memories.Money.from_units(expense["value"])
+        value = total
         if "split" in expense and float(expense["split"]) < 100:
             split_expense = True
-            value = round(float(expense["value"]) * float(expense["split"]) / 100, 2)
-        else:
-            value = float(expense["value"])
+            value = memories.Money(round(total * float(expense["split"]) / 100))
         date = datetime.date.fromisoformat(expense["date"])
         ref = expense["reference"]
         partner = get_partner(self.memory, expense.pop("partner"))
@@ -119,7 +153,7 @@ class Functions():
                 "comment": "private expense",
                 "partner": partner,
                 "source": expense["path"],
-                "debit_amount": round(float(expense["value"]) - value, 2),
+                "debit_amount": memories.Money(total - value),
             })
             booking.save()
 
@@ -2,17 +2,23 @@
 import datetime
 from io import BytesIO
 
-from .. import memories, managers, handlers, lookups
+from .. import memories, managers, handlers, lookups, sql
 from ..templates.invoices import write_invoice, schema
 from ..lookups import get_default_partner, get_mydata
 
 
+def put_sequence(seq, memory):
+    """Save sequence and log it."""
+    events = memories.EventLog(memory).get_events("sequence", [seq])
+    sql.put_many(memory, [seq], appended=events)
+
+
 def get_invoice_no(partner, memory):
     """Get next invoice number."""
     seq = memory.get.sequences(relation=partner.id)
     if not seq:
         seq = memories.Sequences(relation=partner.id, sequence=1)
-        memory.put(seq)
+        put_sequence(seq, memory)
     return partner.invoice_prefix + str(seq.sequence).zfill(3)
 
 
@@ -20,7 +26,7 @@ def confirm_invoice_no(seq, partner_id, memory):
     """Confirm invoice number."""
     seq += 1
     s = memories.Sequences(relation=partner_id, sequence=seq)
-    memory.put(s)
+    put_sequence(s, memory)
 
 
 def get_contact_header(name, address, phone=None, email=None):
@@ -1,44 +1,197 @@
 """Functions related to creating bookings in ledger."""
 
+import base64
 import datetime
+import json
 
-from ..memories import Transaction, ReportStruct, PARTNER_ACCOUNTS
+import numpy as np
+
+from .. import columns, sql
+from ..memories import (
+    DEFAULT_CAR_ODO_KM,
+    MONEY_FIELDS,
+    BalanceIndex,
+    Car,
+    EventLog,
+    FiscalYears,
+    Money,
+    Sequences,
+    Transaction,
+    Trip,
+    ReportStruct,
+    PARTNER_ACCOUNTS,
+    put_transactions,
+)
 from ..handlers import ExcelGenerator, get_csv_text
 from ..lookups import get_partner
 
+PAGE_SIZE = 100  # Default number of transactions listed at once
+
+
+def get_open_stacks(groups, amounts, cover):
+    """Return stacks left open after cover is matched first in first out.
+
+    All arguments are arrays over bookings ordered by group. Groups are
+    group codes, amounts are booking amounts and cover is the amount of
+    group's other side of deals to be matched.
+    """
+    if not len(groups):
+        return amounts.copy()
+    cumsum = np.cumsum(amounts)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    lengths = np.diff(np.r_[starts, len(groups)])
+    cumsum -= np.repeat((cumsum - amounts)[starts], lengths)
+    return np.clip(cumsum - cover, 0, amounts)
+
+
+def recalculate_outstanding(memory, year, partner=None):
+    """Recalculate stacks of bookings on PARTNER_ACCOUNTS for a year.
+
+    Bookings of the year are loaded in one query. For every partner and
+    account the sum of one side of deals is matched against the other
+    side in date order, for all partners at once. Return list of
+    bookings with changed stacks. Stacks of closed fiscal years are
+    final and never changed.
+    """
+    table = sql.get_table(memory, Transaction)
+    if table is None or year in FiscalYears(memory).closed:
+        return []
+    col = table.c
+    where = [
+        col.date >= datetime.date(year=year, month=1, day=1),
+        col.date < datetime.date(year=year + 1, month=1, day=1),
+        col.debit.in_(PARTNER_ACCOUNTS) | col.credit.in_(PARTNER_ACCOUNTS),
+    ]
+    if partner is not None:
+        where.append(col.partner == partner)
+    items = sql.select(memory, Transaction, *where, order_by=(col.date, col.id))
+    if not items:
+        return []
+    partners, codes = np.unique([i.partner for i in items], return_inverse=True)
+    accounts = {
+        "debit": np.array([i.debit for i in items]),
+        "credit": np.array([i.credit for i in items]),
+    }
+    amounts = {
+        "debit": np.array([i.debit_amount for i in items], dtype=np.int64),
+        "credit": np.array([i.credit_amount for i in items], dtype=np.int64),
+    }
+    stacks = {
+        "debit": np.array([i.debit_stack for i in items], dtype=np.int64),
+        "credit": np.array([i.credit_stack for i in items], dtype=np.int64),
+    }
+    changed = {}
+    for acc in PARTNER_ACCOUNTS:
+        totals = {}
+        for side in ("debit", "credit"):
+            rows = accounts[side] == acc
+            totals[side] = np.zeros(len(partners), dtype=np.int64)
+            np.add.at(totals[side], codes[rows], amounts[side][rows])
+        for side, other in (("debit", "credit"), ("credit", "debit")):
+            rows = np.flatnonzero(accounts[side] == acc)
+            rows = rows[np.argsort(codes[rows], kind="stable")]
+            new_stacks = get_open_stacks(
+                codes[rows], amounts[side][rows], totals[other][codes[rows]]
+            )
+            update = new_stacks != stacks[side][rows]
+            for i, stack in zip(rows[update], new_stacks[update]):
+                setattr(items[i], side + "_stack", Money(stack))
+                changed[items[i].id] = items[i]
+    return list(changed.values())
+
+
+def replay_events(memory):
+    """Rebuild ledger and derived memories from event log in one pass.
+
+    Transactions, trips and sequences are folded from events in order
+    of the log and saved in bulk. Stacks are taken as last logged, so
+    matches decided by reconciliation are kept. Balances and car
+    mileage are then derived from them instead of being read and
+    updated per row. Transactions of closed fiscal years are kept in
+    their own files.
+
+    Stored open transactions are replaced by those of the log. Raise
+    RuntimeWarning if any of them was never logged, as replay would
+    drop it.
+    """
+    transactions = {}
+    logged = set()
+    trips = []
+    sequences = {}
+    for event in EventLog(memory).stream():
+        item = dict(event.item)
+        if event.kind == "transaction":
+            item["date"] = datetime.date.fromisoformat(item["date"])
+            transactions[item["id"]] = Transaction(**item)
+            logged.add(item["id"])
+        elif event.kind == "delete":
+            transactions.pop(item["id"], None)
+        elif event.kind == "trip":
+            trips.append(Trip(**item))
+        elif event.kind == "sequence":
+            sequences[item["relation"]] = Sequences(**item)
+    if sql.get_table(memory, Transaction) is not None:
+        stored = sql.select_rows(memory, Transaction, ("id",))
+        missing = {i for i, in stored} - logged
+        if missing:
+            raise RuntimeWarning(
+                f"Event log misses {len(missing)} stored transactions"
+            )
+    closed = FiscalYears(memory).closed
+    items = [i for i in transactions.values() if i.date.year not in closed]
+    sql.replace(memory, Transaction, items)
+    BalanceIndex(memory).rebuild()
+    sql.replace(memory, Trip, trips)
+    sql.replace(memory, Sequences, list(sequences.values()))
+    if trips:
+        km = DEFAULT_CAR_ODO_KM + sum(i.distance for i in trips)
+        sql.put_many(memory, [Car(total_km=km)])
+
+
+def get_page_token(item):
+    """Return opaque token of position right after transaction."""
+    position = json.dumps([item.date.isoformat(), item.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
 
-def get_debitsum_by_partner(mem, year, partner, account):
-    """Return sum of all transaction debit amounts for a partner."""
-    return sum(
-        i.debit_amount
-        for i in get_partner_bookings(mem, year, partner, debit=account)
-    )
-
-
-def get_creditsum_by_partner(mem, year, partner, account):
-    """Return sum of all transaction credit amounts for a partner."""
-    return sum(
-        i.credit_amount
-        for i in get_partner_bookings(mem, year, partner, credit=account)
-    )
-
-
-def get_partner_bookings(mem, year, partner, debit=None, credit=None):
-    """Return sum of all transaction for a partner."""
-    this_year = datetime.date(year=year, month=1, day=1)
-    next_year = datetime.date(year=year + 1, month=1, day=1)
-    partner = get_partner(mem, partner)
-    filters = {"partner": partner}
-    if debit:
-        filters["debit"] = debit
-    if credit:
-        filters["credit"] = credit
-    return mem.get(
-        "transaction",
-        mem.transaction.date >= this_year,
-        mem.transaction.date < next_year,
-        **filters,
-    )
+
+def get_page_position(token):
+    """Return (date, id) position encoded in page token."""
+    try:
+        date, item_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.date.fromisoformat(date), item_id
+    except (ValueError, TypeError) as error:
+        raise RuntimeWarning(f"Invalid page cursor '{token}'") from error
+
+
+def get_transaction_page(
+    memory, start, end, partner=None, cursor=None, size=PAGE_SIZE
+):
+    """Return page of transactions within [start, end) and next cursor.
+
+    Transactions are ordered by date and id. Page is read after the
+    position of cursor with an index seek instead of an offset, next
+    cursor is None on the last page.
+    """
+    if size < 1:
+        raise RuntimeWarning(f"Page size must be positive, got {size}")
+    years = FiscalYears(memory)
+    table = years.get_table(start.year)
+    if table is None:
+        return [], None
+    col = table.c
+    where = [col.date >= start, col.date < end]
+    if partner is not None:
+        where.append(col.partner == partner)
+    if cursor:
+        date, item_id = get_page_position(cursor)
+        where.append(
+            (col.date > date) | ((col.date == date) & (col.id > item_id))
+        )
+    order = (col.date, col.id)
+    items = years.select(start.year, *where, order_by=order, limit=size + 1)
+    if len(items) > size:
+        return items[:size], get_page_token(items[size - 1])
+    return items, None
 
 
 def get_previous_quarter(today=None):
@@ -106,16 +259,20 @@ def update_transaction(data: dict, memory) -> None:
     if "id" not in data:
         raise ValueError("Missing id for transaction update")
     update = memory.get.transaction(id=data["id"])
+    if not update:
+        raise ValueError(f"There is no open transaction '{data['id']}'")
     for attr, value in data.items():
         if attr == "date":
             value = datetime.date.fromisoformat(value)
+        elif attr in MONEY_FIELDS:
+            value = Money.from_units(value)
         elif attr == "partner":
             partner = memory.get.partner(name=value)
             if not partner:
                 raise ValueError(f"There is no such partner '{value}'")
             value = partner.id
         setattr(update, attr, value)
-    memory.put(update)
+    put_transactions(memory, [update])
 
 
 def add_ledger(cls):
@@ -131,23 +288,27 @@ def add_ledger(cls):
             attrs = [i for i in data.keys() if not i.startswith("filter_by")]
             start, end = get_interval_dates(data)
             if start:
-                comp = self.memory.transaction
-                args = ["transaction"]
-                args.append(comp.date >= start)
-                args.append(comp.date < end)
-                items = self.memory.get(*args)
+                ledger = columns.get_year(self.memory, start.year)
+                items = ledger.get_items(ledger.get_mask(start, end))
             else:
-                items = self.memory.get("transaction")
+                items = FiscalYears(self.memory).select_all()
             r_struct = ReportStruct("ledger", items, self.memory, attrs=attrs)
             self.attachment = ExcelGenerator(r_struct).binary()
             self.attachment_filename = "ledger.xlsx"
 
         def do_list_transactions(self):
-            """List transactions in ledger."""
+            """List transactions in ledger page by page.
+
+            year: YYYY
+            month: MM
+            partner: {partner_name}
+            page_size: int = 100
+            cursor: str = first page
+            """
             data = self.data[0]
-            filters = {}
+            partner = None
             if data.get("partner"):
-                filters["partner"] = get_partner(self.memory, data["partner"])
+                partner = get_partner(self.memory, data["partner"])
             today = datetime.date.today()
             year = int(data["year"]) if data.get("year") else today.year
             month = int(data["month"]) if data.get("month") else None
@@ -157,14 +318,19 @@ def add_ledger(cls):
                 month=month + 1 if month else 1,
                 day=1,
             )
-            items = self.memory.get(
-                "transaction",
-                self.memory.transaction.date >= earliest_date,
-                self.memory.transaction.date < latest_date,
-                **filters,
+            size = int(data.get("page_size") or PAGE_SIZE)
+            items, cursor = get_transaction_page(
+                self.memory,
+                earliest_date,
+                latest_date,
+                partner,
+                data.get("cursor"),
+                size,
             )
             r_struct = ReportStruct("ledger", items, self.memory)
             self.status = get_csv_text(r_struct)
+            if cursor:
+                self.status += f"next_cursor: {cursor}\n"
 
         def do_transaction(self):
             """Create transaction in ledger."""
@@ -173,47 +339,57 @@ def add_ledger(cls):
                 partner_id = get_partner(self.memory, self.data["partner"])
                 self.data["partner"] = partner_id
             self.data["date"] = datetime.date.fromisoformat(self.data["date"])
-            self.data["debit_amount"] = float(self.data["debit_amount"])
+            self.data["debit_amount"] = Money.from_units(
+                self.data["debit_amount"]
+            )
             if "debit" in self.data:
                 self.data["debit"] = int(self.data["debit"])
             if "credit" in self.data:
                 self.data["credit"] = int(self.data["credit"])
             booking = Transaction(**self.data)
-            self.memory.put(booking)
+            put_transactions(self.memory, [booking])
 
         def do_update_transaction(self):
             """Update transaction in ledger."""
             self.data = self.data[0]
             update_transaction(self.data, self.memory)
 
+        def do_rebuild_balances(self):
+            """Rebuild running balances of accounts from ledger.
+
+            account: {account} = all accounts
+            """
+            data = self.data[0] if self.data else {}
+            accounts = None
+            if data.get("account"):
+                accounts = [int(data["account"])]
+            BalanceIndex(self.memory).rebuild(accounts)
+
         def do_recalculate_outstanding(self):
-            """Recalculate outstanding entries for a given year and partner."""
+            """Recalculate outstanding entries for a given year.
+
+            year: YYYY
+            partner: {partner_name} = all partners
+            """
+            data = self.data[0]
+            year = int(data["year"])
+            partner = None
+            if data.get("partner"):
+                partner = get_partner(self.memory, data["partner"])
+            changed = recalculate_outstanding(self.memory, year, partner)
+            events = EventLog(self.memory).get_events("transaction", changed)
+            sql.put_many(self.memory, changed, appended=events)
+
+        def do_close_year(self):
+            """Move transactions of fiscal year into read-only file.
+
+            year: YYYY
+            """
             year = int(self.data[0]["year"])
-            partner = self.data[0]["partner"]
-            for acc in PARTNER_ACCOUNTS:
-                debit_stack = get_debitsum_by_partner(
-                    self.memory, year, partner, acc
-                )
-                credit_stack = get_creditsum_by_partner(
-                    self.memory, year, partner, acc
-                )
-                for booking in get_partner_bookings(
-                    self.memory, year, partner, debit=acc
-                ):
-                    credit_stack -= booking.debit_amount
-                    if round(credit_stack, 2) < 0:
-                        booking.debit_stack = round(credit_stack, 2)
-                        break
-                    booking.debit_stack = 0
-                    self.memory.put(booking)
-                for booking in get_partner_bookings(
-                    self.memory, year, partner, credit=acc
-                ):
-                    debit_stack -= booking.credit_amount
-                    if round(debit_stack, 2) < 0:
-                        booking.credit_stack = round(debit_stack, 2)
-                        break
-                    booking.credit_stack = 0
-                    self.memory.put(booking)
+            FiscalYears(self.memory).close(year)
+
+        def do_replay_events(self):
+            """Rebuild ledger, stacks, balances and car mileage from log."""
+            replay_events(self.memory)
 
     return Ledger
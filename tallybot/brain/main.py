@@ -7,10 +7,12 @@ import sys
 import traceback
 import urllib.request
 
+from tallybot import columns
 from tallybot import handlers
 from tallybot import memories
 from tallybot import learner
 from tallybot import managers
+from tallybot import sql
 from tallybot.lookups import get_mydata, get_partner
 
 from . import frontal_lobe
@@ -155,7 +157,8 @@ class Perform(frontal_lobe.Functions):
             self.status = (
                 "Transaction with id '{del_id}' not found so not deleted"
             )
-        self.memory.delete(trans)
+        else:
+            memories.put_transactions(self.memory, deleted=[trans])
 
     def do_add_initial_asset(self):
         """Add initial asset with depreciation calculations.
@@ -174,8 +177,8 @@ class Perform(frontal_lobe.Functions):
         asset["comment"] = f"Initial asset {asset_name}"
         asset["source"] = path
         utility = int(asset.pop("utility"))
-        booking = memories.Booking("init-asset", self.memory, **asset)
-        booking.save()
+        writer = memories.LedgerWriter(self.memory)
+        writer.add(memories.Booking("init-asset", self.memory, **asset))
         data = {
             "date": asset["date"],
             "comment": f"Monthly depreciation for {asset_name}",
@@ -198,46 +201,38 @@ class Perform(frontal_lobe.Functions):
                     month=data["date"].month + 1,
                     day=data["date"].day,
                 )
-            depreciate = memories.Booking(
-                "asset-depreciate", self.memory, **data
+            writer.add(
+                memories.Booking("asset-depreciate", self.memory, **data)
             )
-            depreciate.save()
+        writer.commit()
         handlers.save_file(path, self.binary)
 
     def do_get_social_report(self):
         """Get report for social tax.
 
         quarter: YYYY-Qn
+        ----------------
+        # Any range of months
+        from: YYYY-MM
+        to: YYYY-MM
         """
-        quarter = self.data[0]["quarter"]
-        date = datetime.datetime.strptime(quarter[:4], "%Y")
-        months = {
-            "1": [1, 2, 3],
-            "2": [4, 5, 6],
-            "3": [7, 8, 9],
-            "4": [10, 11, 12],
-        }
+        data = self.data[0]
+        if data.get("quarter"):
+            quarter = data["quarter"]
+            month = (int(quarter[-1]) - 1) * 3 + 1
+            start = datetime.date(year=int(quarter[:4]), month=month, day=1)
+            last = datetime.date(year=start.year, month=month + 2, day=1)
+        else:
+            check_required(data, ["from", "to"])
+            start = datetime.datetime.strptime(data["from"], "%Y-%m").date()
+            last = datetime.datetime.strptime(data["to"], "%Y-%m").date()
+        end = (last + datetime.timedelta(days=31)).replace(day=1)
         self.status = "Social report (profit with 500 deducted already)\n\n"
-        for month in months[quarter[-1]]:
-            start_date = datetime.date(year=date.year, month=month, day=1)
-            end_date = datetime.date(year=date.year, month=month + 1, day=1)
-            book = self.memory.get(
-                self.memory.transaction.date >= start_date,
-                self.memory.transaction.date < end_date,
-            )
-            income = 0
-            expense = 0
-            for i in book:
-                if 6000 <= i.credit < 7000:
-                    income += i.deal_value
-                elif 7000 <= i.debit < 8000:
-                    expense += i.deal_value
-                elif i.debit == 8250:
-                    expense += i.deal_value
-                elif i.credit == 8150:
-                    income += i.deal_value
-            profit = round(income - expense - 500, 2)  # profit above 500
-            self.status += start_date.strftime("%Y-%m") + f": {profit}\n"
+        rows = columns.get_income_expense(self.memory, start, end)
+        for month, income, expense in rows:
+            profit = income - expense - memories.Money.from_units(500)
+            profit = memories.Money(profit).units()  # profit above 500
+            self.status += month.strftime("%Y-%m") + f": {profit}\n"
 
     def do_add_carwash(self):
         """Add expense on carwash.
@@ -287,12 +282,12 @@ class Perform(frontal_lobe.Functions):
             to_save = memories.Trip(**trip)
         except TypeError as error:
             raise RuntimeWarning(str(error)[11:]) from None
-        self.memory.put(to_save)
         car = self.memory.get.car(id=memories.DEFAULT_CAR_PLATE)
         if not car:
             car = memories.Car()
         car.total_km += to_save.distance
-        self.memory.put(car)
+        events = memories.EventLog(self.memory).get_events("trip", [to_save])
+        sql.put_many(self.memory, [to_save, car], appended=events)
         if "receipt_ref" in trip:
             handlers.save_file(path, self.binary)
 
@@ -312,7 +307,7 @@ class Perform(frontal_lobe.Functions):
         booking = self.data[0]
         item = self.memory.get.transaction(id=booking["id"])
         if item:
-            self.memory.delete(item)
+            memories.put_transactions(self.memory, deleted=[item])
         else:
             self.status = f"Id: '{booking['id']}' not found"
 
@@ -523,6 +518,7 @@ class Perform(frontal_lobe.Functions):
         header = 2
         bookings = []
         errs = []
+        partners = {}
         for i in csv_reader:
             book_type = False
             if header:
@@ -541,10 +537,15 @@ class Perform(frontal_lobe.Functions):
                     book_type = "seb-income"
             if "pamatsumma" in i[9] and "KT08093" in i[9]:
                 partner = "SEB banka"
-            try:
-                partner = frontal_lobe.get_partner(self.memory, partner)
-            except RuntimeWarning as error:
-                errs.append(str(error))
+            if partner not in partners:
+                try:
+                    partners[partner] = frontal_lobe.get_partner(
+                        self.memory, partner
+                    )
+                except RuntimeWarning as error:
+                    errs.append(str(error))
+                    partners[partner] = partner
+            partner = partners[partner]
             booking = {
                 "date": date,
                 "reference": i[10],
@@ -559,10 +560,11 @@ class Perform(frontal_lobe.Functions):
             bookings += learner.get_bookings(booking, i)
         if errs:
             raise RuntimeWarning("\n".join(errs))
+        writer = memories.LedgerWriter(self.memory, reconcile=True)
         for booking in bookings:
             book_type = booking.pop("book_type")
-            booking = memories.Booking(book_type, self.memory, **booking)
-            booking.save()
+            writer.add(memories.Booking(book_type, self.memory, **booking))
+        writer.commit()
         handlers.save_file(path, self.binary)
 
     def do_upwork_statement(self):
@@ -573,15 +575,15 @@ class Perform(frontal_lobe.Functions):
         csv_reader = csv.reader(csv_input, delimiter=",")
         fname = "upwork_" + datetime.date.today().isoformat()
         path = self.generate_path("statement", fname, "csv")
-        header = True
-        for i in csv_reader:
-            if header:
-                header = False
-                continue
+        rows = list(csv_reader)[1:]
+        dates = []
+        for i in rows:
             date = datetime.datetime.strptime(i[0], "%b %d, %Y")
-            date = datetime.date(date.year, date.month, date.day)
+            dates.append(datetime.date(date.year, date.month, date.day))
+        rates = self.exchange_rates([(i, "USD") for i in dates])
+        writer = memories.LedgerWriter(self.memory)
+        for i, date, currency in zip(rows, dates, rates):
             value = abs(float(i[9]))
-            currency = self.exchange_rate(date, "USD")
             partner = ""
             if "VAT" in i[2] or "Service Fee" in i[2] or "Withdrawal" in i[2]:
                 partner = frontal_lobe.get_partner(self.memory, "Upwork")
@@ -609,16 +611,20 @@ class Perform(frontal_lobe.Functions):
                     "partner": partner,
                 },
             )
-            booking.save()
+            writer.add(booking)
+        writer.commit()
         handlers.save_file(path, self.binary)
 
     def do_upwork_invoices(self):
         """Upload invoices from Upwork."""
         zip_file = handlers.get_zip(self.binary)
-        for i in zip_file:
-            pdf_text = handlers.get_pdf(i)[0]
-            invoice = handlers.get_invoice(pdf_text)
-            rate = self.exchange_rate(invoice[0], "USD")
+        writer = memories.LedgerWriter(self.memory)
+        files = []
+        invoices = [
+            handlers.get_invoice(handlers.get_pdf(i)[0]) for i in zip_file
+        ]
+        rates = self.exchange_rates([(i[0], "USD") for i in invoices])
+        for i, invoice, rate in zip(zip_file, invoices, rates):
             if "Upwork" in invoice[4]:
                 inv_type = "inc_invoice"
                 partner = frontal_lobe.get_partner(self.memory, "Upwork")
@@ -641,8 +647,11 @@ class Perform(frontal_lobe.Functions):
                     "partner": partner,
                 },
             )
-            booking.save()
-            handlers.save_file(path, binary=i)
+            writer.add(booking)
+            files.append((path, i))
+        writer.commit()
+        for path, binary in files:
+            handlers.save_file(path, binary=binary)
 
     def do_accounts_update(self):
         """Upload accounts from external source."""
@@ -5,7 +5,13 @@ Primarily functions on handling Excel reports
 
 import datetime
 
-from .. import handlers, memories
+import numpy as np
+
+from .. import columns, handlers, memories, sql, statements
+from .invoicing import get_invoice_terms
+from .ledger import get_interval_dates
+
+AGING_BUCKETS = (31, 61, 91)  # First days overdue of buckets after first
 
 
 def get_report_struct(data, mem):
@@ -14,27 +20,165 @@ def get_report_struct(data, mem):
         year = int(data.get("year", datetime.date.today().year))
     else:
         year = datetime.date.today().year
-    year_start = datetime.date(year=year, month=1, day=1)
-    year_end = datetime.date(year=year, month=12, day=31)
+    ledger = columns.get_year(mem, year)
     items = []
-    filters = (
-        (mem.transaction.debit_stack, mem.transaction.debit),
-        (mem.transaction.credit_stack, mem.transaction.credit),
-    )
-    args = [None, None]
-    args += [
-        mem.transaction.date >= year_start,
-        mem.transaction.date <= year_end,
-    ]
-    for i in filters:
-        # pylint: disable=C0121
-        args[0] = i[0] > 0
+    for side in ("debit", "credit"):
+        open_rows = getattr(ledger, f"{side}_stack") > 0
         for account in [2310, 5310]:
-            args[1] = i[1] == account
-            items += mem.get(*args)
+            mask = open_rows & (getattr(ledger, side) == account)
+            items += ledger.get_items(mask)
     return memories.ReportStruct("outstanding", items, mem)
 
 
+def get_trial_balance_struct(data, mem):
+    """Get trial balance structure at the end of date in data."""
+    date = datetime.date.today()
+    if data and data.get("date"):
+        date = datetime.date.fromisoformat(data["date"])
+    balances = memories.BalanceIndex(mem).get_balances(date)
+    names = dict(sql.select_rows(mem, memories.Account, ("id", "name")))
+    items = [
+        memories.AccountBalance(i, names.get(i, ""), balance)
+        for i, balance in balances.items()
+    ]
+    return memories.ReportStruct("trialbalance", items, mem)
+
+
+def get_partner_terms(mem):
+    """Return dict of payment terms in days by partner ids."""
+    terms = {}
+    for partner, text in sql.select_rows(
+        mem, memories.Partner, ("id", "terms")
+    ):
+        try:
+            terms[partner] = get_invoice_terms(text)
+        except ValueError:
+            terms[partner] = 0
+    return terms
+
+
+def get_aging_rows(mem, date):
+    """Return list of AgingRow of open stacks on 2310 and 5310 at date.
+
+    Open items are read in one query per closed fiscal year and one for
+    open years. Due dates come from payment terms of partners and days
+    overdue are bucketed for all items at once. Debit stacks are
+    positive and credit stacks negative.
+    """
+    accounts = memories.PARTNER_ACCOUNTS
+
+    def where(table):
+        """Return where clauses of open items on table of a year."""
+        col = table.c
+        return (
+            col.date <= date,
+            (col.debit.in_(accounts) & (col.debit_stack > 0))
+            | (col.credit.in_(accounts) & (col.credit_stack > 0)),
+        )
+
+    rows = memories.FiscalYears(mem).select_all_rows(
+        ("date", "partner", "debit", "credit", "debit_stack", "credit_stack"),
+        where,
+    )
+    if not rows:
+        return []
+    days, partners, debits, credits, debit_stacks, credit_stacks = (
+        np.array(i) for i in zip(*rows)
+    )
+    days = np.array([columns.get_day(i) for i in days], dtype=np.int32)
+    debit_rows = np.isin(debits, accounts) & (debit_stacks > 0)
+    credit_rows = np.isin(credits, accounts) & (credit_stacks > 0)
+    account = np.concatenate([debits[debit_rows], credits[credit_rows]])
+    partner = np.concatenate([partners[debit_rows], partners[credit_rows]])
+    amount = np.concatenate(
+        [debit_stacks[debit_rows], -credit_stacks[credit_rows]]
+    ).astype(np.int64)
+    day = np.concatenate([days[debit_rows], days[credit_rows]])
+    terms = get_partner_terms(mem)
+    names, codes = np.unique(partner, return_inverse=True)
+    due = day + np.array([terms.get(i, 0) for i in names])[codes]
+    overdue = columns.get_day(date) - due
+    buckets = np.digitize(overdue, AGING_BUCKETS)
+    groups, group_codes = np.unique(
+        np.stack([codes, account], axis=1), axis=0, return_inverse=True
+    )
+    sums = np.zeros((len(groups), len(AGING_BUCKETS) + 1), dtype=np.int64)
+    np.add.at(sums, (group_codes.ravel(), buckets), amount)
+    money = memories.Money
+    return [
+        memories.AgingRow(
+            str(names[code]),
+            int(acc),
+            *(money(i) for i in sums[n]),
+            money(sums[n].sum()),
+        )
+        for n, (code, acc) in enumerate(groups)
+    ]
+
+
+def get_vat_masks(ledger):
+    """Return dict of masks of VAT return lines by their names.
+
+    Sales are outgoing invoices credited on 6110, VAT is booked by vat
+    and service fee records from 5310 to 2670.
+    """
+    return {
+        "sales": ledger.credit == 6110,
+        "vat": (ledger.debit == 5310) & (ledger.credit == 2670),
+    }
+
+
+def get_partner_countries(mem):
+    """Return dict of address countries by partner ids."""
+    addresses = sql.select_rows(mem, memories.Address, ("id", "country"))
+    countries = dict(addresses)
+    partners = sql.select_rows(mem, memories.Partner, ("id", "address_id"))
+    return {i: countries.get(address, "") for i, address in partners}
+
+
+def get_vat_rows(mem, start, end):
+    """Return list of VatRow by month and partner country in [start, end).
+
+    Deal values of every fiscal year in range are summed in one grouped
+    pass over cached ledger columns.
+    """
+    countries = get_partner_countries(mem)
+    last = end - datetime.timedelta(days=1)
+    totals = {}
+    for year in range(start.year, last.year + 1):
+        ledger = columns.get_year(mem, year)
+        mask = ledger.get_mask(start, end)
+        names, codes = np.unique(
+            np.array([countries.get(i, "") for i in ledger.partners], str),
+            return_inverse=True,
+        )
+        codes = codes[ledger.partner]
+        for line, rows in get_vat_masks(ledger).items():
+            rows &= mask
+            sums = np.zeros((12, len(names)), dtype=np.int64)
+            index = (ledger.month[rows] - 1, codes[rows])
+            np.add.at(sums, index, ledger.deal_value[rows])
+            for month, code in zip(*np.nonzero(sums)):
+                period = datetime.date(year=year, month=month + 1, day=1)
+                key = (period.strftime("%Y-%m"), str(names[code]))
+                totals.setdefault(key, {"sales": 0, "vat": 0})
+                totals[key][line] += sums[month, code]
+    money = memories.Money
+    return [
+        memories.VatRow(*key, money(i["sales"]), money(i["vat"]))
+        for key, i in sorted(totals.items())
+    ]
+
+
+def get_current_quarter(today=None):
+    """Return start date and end date of quarter of today."""
+    if today is None:
+        today = datetime.date.today()
+    start = datetime.date(today.year, (today.month - 1) // 3 * 3 + 1, 1)
+    end = (start + datetime.timedelta(days=92)).replace(day=1)
+    return start, end
+
+
 def add_reports(cls):
     """Decorate cls with report functions."""
 
@@ -54,4 +198,90 @@ def add_reports(cls):
             r_struct = get_report_struct(self.data, self.memory)
             self.status = handlers.get_csv_text(r_struct)
 
+        def do_get_trial_balance(self):
+            """Get closing balances of all accounts in Excel and text.
+
+            date: YYYY-MM-DD = today
+            """
+            self.data = self.data[0] if self.data else self.data
+            r_struct = get_trial_balance_struct(self.data, self.memory)
+            self.status = handlers.get_csv_text(r_struct)
+            self.attachment = handlers.ExcelGenerator(r_struct).binary()
+            self.attachment_filename = "trial_balance.xlsx"
+
+        def do_get_aging_report(self):
+            """Get open items of partners by days overdue.
+
+            date: YYYY-MM-DD = today
+            """
+            data = self.data[0] if self.data else {}
+            date = datetime.date.today()
+            if data.get("date"):
+                date = datetime.date.fromisoformat(data["date"])
+            items = get_aging_rows(self.memory, date)
+            r_struct = memories.ReportStruct("aging", items, self.memory)
+            self.status = handlers.get_csv_text(r_struct)
+            self.attachment = handlers.ExcelGenerator(r_struct).binary()
+            self.attachment_filename = "aging.xlsx"
+
+        def do_get_vat_report(self):
+            """Get VAT totals by month and partner country.
+
+            filter_by_quarter: qN or last = current quarter
+            filter_by_year: YYYY = whole year without quarter
+            ----------------
+            filter_by_month: YYYY-MM
+            """
+            data = self.data[0] if self.data else {}
+            data.setdefault("filter_by_year", None)
+            start, end = get_interval_dates(data)
+            if not start and data["filter_by_year"]:
+                year = int(data["filter_by_year"])
+                start = datetime.date(year=year, month=1, day=1)
+                end = datetime.date(year=year + 1, month=1, day=1)
+            elif not start:
+                start, end = get_current_quarter()
+            items = get_vat_rows(self.memory, start, end)
+            r_struct = memories.ReportStruct("vat", items, self.memory)
+            self.status = handlers.get_csv_text(r_struct)
+            self.attachment = handlers.ExcelGenerator(r_struct).binary()
+            self.attachment_filename = "vat.xlsx"
+
+        def do_get_balance_sheet(self):
+            """Get balance sheet rolled up to account classes.
+
+            date: YYYY-MM-DD = today
+            """
+            data = self.data[0] if self.data else {}
+            date = datetime.date.today()
+            if data.get("date"):
+                date = datetime.date.fromisoformat(data["date"])
+            items = statements.get_balance_sheet(self.memory, date)
+            self.send_statement("balance_sheet", items)
+
+        def do_get_profit_loss(self):
+            """Get profit and loss rolled up to account classes.
+
+            filter_by_year: YYYY = current year
+            filter_by_quarter: qN or last
+            ----------------
+            filter_by_month: YYYY-MM
+            """
+            data = self.data[0] if self.data else {}
+            data.setdefault("filter_by_year", None)
+            start, end = get_interval_dates(data)
+            if not start:
+                year = int(data["filter_by_year"] or datetime.date.today().year)
+                start = datetime.date(year=year, month=1, day=1)
+                end = datetime.date(year=year + 1, month=1, day=1)
+            items = statements.get_profit_loss(self.memory, start, end)
+            self.send_statement("profit_loss", items)
+
+        def send_statement(self, name, items):
+            """Set statement rows as text status and Excel attachment."""
+            r_struct = memories.ReportStruct("statement", items, self.memory)
+            self.status = handlers.get_csv_text(r_struct)
+            self.attachment = handlers.ExcelGenerator(r_struct).binary()
+            self.attachment_filename = f"{name}.xlsx"
+
     return ReportFunctions
@@ -131,9 +131,10 @@ def do_get_myself():
 
 
 def do_recalculate_outstanding():
-    """Recalculate outstanding items per partner."""
+    """Recalculate outstanding items of a year."""
     return Interface(
-        required={"year", "partner"},
+        required={"year"},
+        optional={"partner"},
     )
 
 
@@ -142,6 +143,41 @@ def do_get_outstanding():
     return Interface()
 
 
+def do_get_trial_balance():
+    """Closing balances of all accounts at date."""
+    return Interface(
+        optional={"date"},
+    )
+
+
+def do_get_vat_report():
+    """VAT totals by month and partner country."""
+    return Interface(
+        optional={"filter_by_quarter", "filter_by_year", "filter_by_month"},
+    )
+
+
+def do_get_balance_sheet():
+    """Balance sheet at date."""
+    return Interface(
+        optional={"date"},
+    )
+
+
+def do_get_profit_loss():
+    """Profit and loss of a period."""
+    return Interface(
+        optional={"filter_by_year", "filter_by_quarter", "filter_by_month"},
+    )
+
+
+def do_get_aging_report():
+    """Open items of partners by days overdue."""
+    return Interface(
+        optional={"date"},
+    )
+
+
 def do_create_partner():
     """Define partner requirements."""
     return Interface(
@@ -0,0 +1,159 @@
+"""Columnar cache of ledger transactions.
+
+Transactions of a fiscal year are loaded once into NumPy arrays so
+reports can filter and aggregate with vectorized operations instead of
+attribute access on every Transaction. Dates are day numbers, accounts
+are int16, amounts are int64 cents and partners are dictionary encoded.
+
+Any insert, update or delete on transaction table through the memory
+engine drops cached years, so the next read loads fresh data.
+
+>>> ledger = get_year(memory, 2023)
+>>> mask = ledger.get_mask(start, end) & (ledger.credit == 6110)
+>>> ledger.get_sum("deal_value", mask)
+>>> get_income_expense(memory, start, end)
+"""
+
+import dataclasses
+import datetime
+import weakref
+
+import numpy as np
+import sqlalchemy as sa
+
+from . import sql
+from .memories import MONEY_FIELDS, FiscalYears, Money, Transaction
+
+caches = weakref.WeakKeyDictionary()  # engine: {year: LedgerColumns}
+
+
+def get_day(date):
+    """Return day number of date as stored in date column."""
+    return date.toordinal()
+
+
+class LedgerColumns:
+    """Transactions of one fiscal year as NumPy columns."""
+
+    def __init__(self, items):
+        """Build columns from list of transactions."""
+        self.items = items
+        self.date = np.array([get_day(i.date) for i in items], dtype=np.int32)
+        self.month = np.array([i.date.month for i in items], dtype=np.int8)
+        self.debit = np.array([i.debit for i in items], dtype=np.int16)
+        self.credit = np.array([i.credit for i in items], dtype=np.int16)
+        for name in MONEY_FIELDS:
+            values = [getattr(i, name) for i in items]
+            setattr(self, name, np.array(values, dtype=np.int64))
+        self.partners, self.partner = np.unique(
+            np.array([i.partner or "" for i in items], dtype=str),
+            return_inverse=True,
+        )
+
+    def __len__(self):
+        """Return number of transactions."""
+        return len(self.items)
+
+    def get_partner_code(self, partner):
+        """Return code of partner id or -1 if partner has no transactions."""
+        pos = np.searchsorted(self.partners, partner)
+        if pos < len(self.partners) and self.partners[pos] == partner:
+            return pos
+        return -1
+
+    def get_mask(self, start=None, end=None, partner=None):
+        """Return mask of transactions within [start, end) and of partner."""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.date >= get_day(start)
+        if end is not None:
+            mask &= self.date < get_day(end)
+        if partner is not None:
+            mask &= self.partner == self.get_partner_code(partner)
+        return mask
+
+    def get_items(self, mask):
+        """Return copies of transactions selected by mask."""
+        return [
+            dataclasses.replace(self.items[i]) for i in np.flatnonzero(mask)
+        ]
+
+    def get_sum(self, name, mask):
+        """Return sum of amount column over mask."""
+        return Money(getattr(self, name)[mask].sum())
+
+    def get_month_sums(self, name, mask):
+        """Return array of sums of amount column over mask by month - 1."""
+        sums = np.zeros(12, dtype=np.int64)
+        np.add.at(sums, self.month[mask] - 1, getattr(self, name)[mask])
+        return sums
+
+    def get_class_masks(self):
+        """Return income and expense masks by account classes.
+
+        Income is credit on 6xxx, expense is debit on 7xxx or on 8250
+        exchange loss, otherwise credit on 8150 exchange profit is income.
+        """
+        income = (self.credit >= 6000) & (self.credit < 7000)
+        expense = ~income & (
+            ((self.debit >= 7000) & (self.debit < 8000)) | (self.debit == 8250)
+        )
+        income |= ~expense & (self.credit == 8150)
+        return income, expense
+
+
+def forget(conn, clause, *args):
+    """Drop cached years when transaction table is written to."""
+    table = getattr(clause, "table", None)
+    if getattr(clause, "is_dml", False) and table is not None:
+        if table.name == sql.get_table_name(Transaction):
+            caches.get(conn.engine, {}).clear()
+
+
+def get_cache(memory):
+    """Return dict of cached years for memory."""
+    engine = sql.get_engine(memory)
+    if engine not in caches:
+        caches[engine] = {}
+        sa.event.listen(engine, "after_execute", forget)
+    return caches[engine]
+
+
+def get_year(memory, year):
+    """Return LedgerColumns of fiscal year, loading them if needed."""
+    cache = get_cache(memory)
+    if year not in cache:
+        items = []
+        years = FiscalYears(memory)
+        table = years.get_table(year)
+        if table is not None:
+            items = years.select(
+                year,
+                table.c.date >= datetime.date(year=year, month=1, day=1),
+                table.c.date < datetime.date(year=year + 1, month=1, day=1),
+            )
+        cache[year] = LedgerColumns(items)
+    return cache[year]
+
+
+def get_income_expense(memory, start, end):
+    """Return list of (month, income, expense) of months in [start, end).
+
+    Months are first days of months, start and end are first days of
+    months too. Income and expense are deal values summed by account
+    classes in one vectorized pass over every fiscal year in range.
+    """
+    rows = []
+    for year in range(start.year, end.year + 1):
+        ledger = get_year(memory, year)
+        mask = ledger.get_mask(start, end)
+        income, expense = ledger.get_class_masks()
+        income = ledger.get_month_sums("deal_value", mask & income)
+        expense = ledger.get_month_sums("deal_value", mask & expense)
+        for month in range(1, 13):
+            date = datetime.date(year=year, month=month, day=1)
+            if start <= date < end:
+                rows.append(
+                    (date, Money(income[month - 1]), Money(expense[month - 1]))
+                )
+    return rows
@@ -1,53 +1,392 @@
-"""Module provides external exchange rates."""
+"""Module provides external exchange rates.
 
+ECB feeds are parsed into sorted arrays of day numbers (date.toordinal)
+and rates per currency, the XML is not kept. Rate of a date is the last
+rate published before that date.
+
+Rates are downloaded by a RateProvider, ECBProvider by default, that
+asks for feeds of recent days if those are enough and downloads whole
+history only if they are not.
+
+Rates are looked up through RateStore only. It keeps the history in
+memory database, so rates of past dates are read without network after
+the first download or after seeding from local ECB file. Async workers
+load the store with RateStore.aload, which downloads in a thread through
+RateService, so event loop is not blocked and concurrent loads share
+one download.
+
+>>> RateStore(memory, "eurofxref-hist.csv").get_rate("USD", date)
+>>> await RateStore(memory).aload(date)
+"""
+
+import abc
+import asyncio
+import bisect
+import csv
 import datetime
-import urllib.request
+import io
+import threading
+import weakref
 import xml.etree.ElementTree as ET
 
+import numpy as np
+import requests
+import sqlalchemy as sa
+
+from . import sql
+from .memories import MySelf, Rate, indexes
+
+ECB_URL = "https://www.ecb.europa.eu/stats/eurofxref/"
+ECB_FEEDS = (
+    "eurofxref-daily.xml",
+    "eurofxref-hist-90d.xml",
+)  # Feeds of recent rates, shortest first
+ECB_HISTORY = "eurofxref-sdmx.xml"  # Feed of all rates since 1999
+TIMEOUT = (5, 60)  # Seconds to connect to and to read from rate provider
+STORE_KEY = "exchange_rates"  # MySelf key of date rates are stored until
+
+cache = weakref.WeakKeyDictionary()  # engine: (until, rates by currency)
+
 
-XML_MEMORY: tuple = tuple()  # Holds xml in memory
+def parse_rates(ext_xml):
+    """Return dict of (days, rates) arrays by currency from ECB xml.
+
+    Both SDMX history and eurofxref feeds of Cube elements are read.
+    Elements are cleared as they are read, so whole tree is never kept.
+    """
+    series = {}
+    currency = None
+    day = None
+    for event, elem in ET.iterparse(io.BytesIO(ext_xml), ("start", "end")):
+        tag = elem.tag.split("}")[-1]
+        if tag == "Cube" and event == "start" and "time" in elem.attrib:
+            day = datetime.date.fromisoformat(elem.attrib["time"]).toordinal()
+        elif tag == "Cube" and event == "end" and "currency" in elem.attrib:
+            obs = (day, float(elem.attrib["rate"]))
+            series.setdefault(elem.attrib["currency"], []).append(obs)
+        elif tag == "Cube" and event == "end" and "time" in elem.attrib:
+            elem.clear()
+        elif event == "start" and tag == "Series":
+            currency = elem.attrib["CURRENCY"]
+            series.setdefault(currency, [])
+        elif event == "end" and tag == "Obs" and currency:
+            period = elem.attrib["TIME_PERIOD"]
+            day = datetime.date.fromisoformat(period).toordinal()
+            series[currency].append((day, float(elem.attrib["OBS_VALUE"])))
+            elem.clear()
+        elif event == "end" and tag == "Series":
+            currency = None
+            elem.clear()
+    return get_arrays(series)
 
 
-# pylint: disable=global-statement,too-many-locals
-def get_rate(pair, date, base="EUR"):
-    """Give an exchange rate for a date on given pair.
+def parse_csv(text):
+    """Return dict of (days, rates) arrays by currency from ECB csv.
 
-    Otherwise raises Exception.
+    Text is ECB eurofxref-hist.csv with a row of rates per date and a
+    column per currency, N/A where currency has no rate.
     """
-    global XML_MEMORY
-    if base != "EUR":
-        raise RuntimeError("Only EUR as base currency supported for now")
-    day = datetime.timedelta(days=1)
-    date = datetime.date(date.year, date.month, date.day) - day
-    if not XML_MEMORY or XML_MEMORY[0] < date:
-        url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-sdmx.xml"
-        with urllib.request.urlopen(url) as response:
-            ext_xml = response.read()
-        XML_MEMORY = (datetime.date.today(), ET.fromstring(ext_xml))
-    # pylint: disable=too-many-nested-blocks
+    series = {}
+    reader = csv.reader(text.splitlines())
+    header = [i.strip() for i in next(reader)]
+    for row in reader:
+        day = datetime.date.fromisoformat(row[0].strip()).toordinal()
+        for curr, value in zip(header[1:], row[1:]):
+            value = value.strip()
+            if curr and value and value != "N/A":
+                series.setdefault(curr, []).append((day, float(value)))
+    return get_arrays(series)
+
+
+def read_rates(path):
+    """Return dict of (days, rates) arrays by currency from ECB file."""
+    with open(path, "rb") as file:
+        content = file.read()
+    if path.lower().endswith(".csv"):
+        return parse_csv(content.decode())
+    return parse_rates(content)
+
+
+def get_arrays(series):
+    """Return dict of sorted (days, rates) arrays from observation lists."""
     rates = {}
-    for child in XML_MEMORY[1]:
-        tag = child.tag.split("}")
-        if len(tag) > 1 and tag[1] == "DataSet":
-            for item in child:
-                tag = item.tag.split("}")
-                if len(tag) > 1 and tag[1] == "Series":
-                    curr = item.attrib["CURRENCY"]
-                    if curr == pair:
-                        for subitems in item:
-                            period = subitems.attrib["TIME_PERIOD"]
-                            rate = float(subitems.attrib["OBS_VALUE"])
-                            rates[period] = rate
-    dtfmt = "%Y-%m-%d"
-    to_hit = date.strftime(dtfmt)
-    if to_hit in rates:
-        return rates[to_hit]
-    while to_hit[:4] >= "2022":
-        # pylint: disable=line-too-long
-        to_hit = (
-            datetime.datetime.strptime(to_hit, dtfmt)
-            - datetime.timedelta(days=1)
-        ).strftime(dtfmt)
-        if to_hit in rates:
-            return rates[to_hit]
-    raise RuntimeError(f"Could not find rate for '{pair}' on '{date}'")
+    for curr, obs in series.items():
+        obs.sort()
+        rates[curr] = (
+            np.array([i[0] for i in obs], dtype=np.int64),
+            np.array([i[1] for i in obs], dtype=np.float64),
+        )
+    return rates
+
+
+def get_last(rates):
+    """Return last date of rates or None if there are none."""
+    days = [int(i[0][-1]) for i in rates.values() if len(i[0])]
+    return datetime.date.fromordinal(max(days)) if days else None
+
+
+class RateProvider(abc.ABC):
+    """Source of rates by currency.
+
+    Subclasses implement get_rates, see ECBProvider.
+    """
+
+    @abc.abstractmethod
+    def get_rates(self, since=None):
+        """Return dict of (days, rates) arrays by currency.
+
+        Rates hold at least all days after since or whole history if
+        since is None.
+        """
+
+
+class ECBProvider(RateProvider):
+    """Rates of ECB eurofxref feeds.
+
+    Feeds of recent days are used if they reach back to since, whole
+    history only otherwise. Feeds are requested over one pooled session
+    with timeouts and conditionally with ETag and Last-Modified of the
+    previous response, so feed not changed since is not downloaded.
+    Downloads of one provider run one at a time, so threads waiting for
+    a feed get it from the previous response if it has not changed.
+    """
+
+    def __init__(self, url=ECB_URL, timeout=TIMEOUT):
+        """Initialise with base url of feeds."""
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.feeds = {}  # feed: (validator headers, rates)
+
+    def fetch(self, feed):
+        """Return rates of feed, downloaded only if it has changed."""
+        validators, rates = self.feeds.get(feed, ({}, None))
+        headers = {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+        response = self.session.get(
+            self.url + feed, headers=headers, timeout=self.timeout
+        )
+        if response.status_code == 304 and rates is not None:
+            return rates
+        response.raise_for_status()
+        rates = parse_rates(response.content)
+        validators = {
+            i: response.headers[i]
+            for i in ("ETag", "Last-Modified")
+            if i in response.headers
+        }
+        self.feeds[feed] = (validators, rates)
+        return rates
+
+    def get_rates(self, since=None):
+        """Return rates of shortest feed that has all days after since."""
+        with self.lock:
+            return self.get_feed_rates(since)
+
+    def get_feed_rates(self, since):
+        """Return rates of shortest feed without taking the lock."""
+        if since is not None:
+            start = since + datetime.timedelta(days=1)
+            for feed in ECB_FEEDS:
+                rates = self.fetch(feed)
+                first = [int(i[0][0]) for i in rates.values() if len(i[0])]
+                if first:
+                    first = datetime.date.fromordinal(min(first))
+                    if np.busday_count(start, first) <= 0:
+                        return rates
+        return self.fetch(ECB_HISTORY)
+
+
+class RateService:
+    """Downloads of rate providers that do not block event loop.
+
+    Provider runs in a thread. Concurrent callers asking the same
+    provider for the same rates await one shared download (single
+    flight), that is forgotten once done.
+    """
+
+    def __init__(self):
+        """Initialise without downloads in flight."""
+        self.flights = {}  # (loop, provider, since): task
+
+    async def get_rates(self, provider, since=None):
+        """Return rates of provider.get_rates(since) shared by callers."""
+        key = (asyncio.get_running_loop(), provider, since)
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                asyncio.to_thread(provider.get_rates, since)
+            )
+            self.flights[key] = task
+            task.add_done_callback(lambda _: self.flights.pop(key, None))
+        return await asyncio.shield(task)
+
+
+PROVIDER = ECBProvider()  # Default provider of rates
+SERVICE = RateService()  # Downloads of async callers
+
+
+def find_rates(rates, pair, dates):
+    """Return array of last rates of pair before dates.
+
+    Rates are dict of (days, rates) arrays by currency, dates are looked
+    up with one searchsorted. Otherwise raises RuntimeError.
+    """
+    days = np.array([i.toordinal() for i in dates], dtype=np.int64) - 1
+    if pair not in rates:
+        raise RuntimeError(f"Could not find rate for '{pair}'")
+    known, values = rates[pair]
+    pos = np.searchsorted(known, days, side="right") - 1
+    if (pos < 0).any():
+        date = dates[int(np.argmax(pos < 0))]
+        raise RuntimeError(f"Could not find rate for '{pair}' on '{date}'")
+    return values[pos]
+
+
+class RateStore:
+    """ECB rates kept in memory database.
+
+    On first use whole history is read from local ECB xml or csv file
+    if given, otherwise downloaded, and saved in one write. Later
+    downloads add only rates published since. Date rates are complete
+    until is kept in MySelf, so rates of dates before it are read from
+    database only.
+
+    History of a currency is read once into sorted (days, rates) arrays
+    cached per database until rates are stored until a later date, so
+    lookups of one date are a bisect and of many dates a searchsorted.
+    """
+
+    def __init__(self, memory, path=None, provider=None):
+        """Initialise with memory access and optional local ECB file."""
+        self.memory = memory
+        self.path = path
+        self.provider = provider or PROVIDER
+
+    def get_until(self):
+        """Return date rates are stored until or None if there are none."""
+        if sql.get_table(self.memory, MySelf) is None:
+            return None
+        item = self.memory.get.myself(key=STORE_KEY)
+        return datetime.date.fromisoformat(item.text) if item else None
+
+    def get_last(self):
+        """Return date of last stored rate or None if there are none."""
+        table = sql.get_table(self.memory, Rate)
+        if table is None:
+            return None
+        stmt = sa.select(sa.func.max(table.c.date))
+        with sql.get_engine(self.memory).connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    def save(self, rates, until):
+        """Save rates newer than stored ones in one write."""
+        missing = sql.get_table(self.memory, Rate) is None
+        last = self.get_last()
+        after = last.toordinal() if last else 0
+        items = [
+            Rate(datetime.date.fromordinal(int(day)), curr, float(rate))
+            for curr, (days, values) in rates.items()
+            for day, rate in zip(days[days > after], values[days > after])
+        ]
+        items.append(MySelf(key=STORE_KEY, text=until.isoformat()))
+        sql.put_many(self.memory, items)
+        cache.pop(sql.get_engine(self.memory), None)
+        if missing:
+            sql.create_indexes(self.memory, Rate, indexes[Rate])
+
+    def seed(self, path):
+        """Save rates of local ECB xml or csv file."""
+        rates = read_rates(path)
+        self.save(rates, get_last(rates))
+
+    def is_loaded(self, date):
+        """Return True if rates are stored until date, seed them if none."""
+        until = self.get_until()
+        if until is None and self.path:
+            self.seed(self.path)
+            until = self.get_until()
+        return until is not None and until >= date
+
+    def load(self, date):
+        """Make sure rates are stored at least until date."""
+        if not self.is_loaded(date):
+            rates = self.provider.get_rates(self.get_last())
+            self.save(rates, datetime.date.today())
+
+    async def aload(self, date):
+        """Make sure rates are stored until date without blocking loop."""
+        if not self.is_loaded(date):
+            since = self.get_last()
+            rates = await SERVICE.get_rates(self.provider, since)
+            if not self.is_loaded(date):
+                self.save(rates, datetime.date.today())
+
+    def get_arrays(self, currencies):
+        """Return dict of cached (days, rates) arrays by currencies.
+
+        Currencies not cached yet are read in one query of their whole
+        stored history, empty if no rate was ever stored. Cache is dropped
+        when rates are stored until another date.
+        """
+        engine = sql.get_engine(self.memory)
+        until = self.get_until()
+        if engine not in cache or cache[engine][0] != until:
+            cache[engine] = (until, {})
+        rates = cache[engine][1]
+        series = {i: [] for i in set(currencies) - set(rates)}
+        table = sql.get_table(self.memory, Rate)
+        if series and table is not None:
+            rows = sql.select_rows(
+                self.memory,
+                Rate,
+                ("currency", "date", "rate"),
+                table.c.currency.in_(list(series)),
+            )
+            for curr, date, rate in rows:
+                series[curr].append((date.toordinal(), rate))
+        rates.update(get_arrays(series))
+        return rates
+
+    def get_rates(self, pairs, base="EUR"):
+        """Give exchange rates for list of (date, pair) in its order.
+
+        Rates are looked up in cached arrays of each currency with one
+        searchsorted. Otherwise raises RuntimeError.
+        """
+        if base != "EUR":
+            raise RuntimeError("Only EUR as base currency supported for now")
+        if not pairs:
+            return []
+        dates = [datetime.date(i.year, i.month, i.day) for i, _ in pairs]
+        self.load(max(dates) - datetime.timedelta(days=1))
+        currencies = np.array([i for _, i in pairs])
+        rates = self.get_arrays(set(currencies.tolist()))
+        result = np.zeros(len(pairs), dtype=np.float64)
+        for curr in set(currencies.tolist()):
+            pos = np.flatnonzero(currencies == curr)
+            result[pos] = find_rates(rates, curr, [dates[i] for i in pos])
+        return result.tolist()
+
+    def get_rate(self, pair, date, base="EUR"):
+        """Give an exchange rate for a date on given pair.
+
+        Rate is the last one published before date, looked up with
+        bisect in cached arrays. Otherwise raises RuntimeError.
+        """
+        if base != "EUR":
+            raise RuntimeError("Only EUR as base currency supported for now")
+        date = datetime.date(date.year, date.month, date.day)
+        day = date.toordinal() - 1
+        self.load(datetime.date.fromordinal(day))
+        rates = self.get_arrays([pair])
+        if pair in rates:
+            known, values = rates[pair]
+            pos = bisect.bisect_right(known, day) - 1
+            if pos >= 0:
+                return float(values[pos])
+        raise RuntimeError(f"Could not find rate for '{pair}' on '{date}'")
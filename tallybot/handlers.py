@@ -5,7 +5,7 @@ import io
 import json
 import os
 import re
-import string
+import tempfile
 import zipfile
 
 import pdftotext  # type: ignore[import-not-found]
@@ -31,61 +31,51 @@ def get_content(msg):
     return data, attachment
 
 
+def get_excel_rows(r_struct):
+    """Yield rows of cell values of report structure.
+
+    Header cells are placed at their coordinates above the start row,
+    capitalised attribute names are on the start row followed by one
+    row per item.
+    """
+    header = {}
+    for coordinate, value in r_struct.header:
+        column, row = openpyxl.utils.cell.coordinate_from_string(coordinate)
+        column = openpyxl.utils.cell.column_index_from_string(column)
+        header.setdefault(row, {})[column] = value
+    for row in range(1, r_struct.start):
+        cells = header.get(row, {})
+        yield [cells.get(i) for i in range(1, max(cells, default=0) + 1)]
+    yield [i.capitalize() for i in r_struct.attrs]
+    for item in r_struct.items:
+        yield [getattr(item, i) for i in r_struct.attrs]
+
+
 # pylint: disable=R0903
 class ExcelGenerator:
-    """Generates Excel."""
+    """Generates Excel.
+
+    Sheets are written in openpyxl write-only mode row by row into a
+    spooled temporary file, so no cell objects are kept in memory.
+    """
+
+    spool_size = 2**22  # Bytes kept in memory before spooling to disk
 
     def __init__(self, *r_structs):
-        """From Report structure will generate Excel binary."""
+        """From Report structures will generate Excel binary."""
         self.__r_structs = r_structs
-        self.__write_excel_sheets()
-
-    def __write_excel_sheets(self):
-        """Convert r_structs to Excel rows format."""
-        self.__sheets = []
-        for r_struct in self.__r_structs:
-            rows = []
-            rows += r_struct.header
-            start = r_struct.start
-            for i, j in enumerate(r_struct.attrs):
-                rows.append(
-                    (f"{string.ascii_uppercase[i]}{str(start)}", j.capitalize())
-                )
-            for a, item in enumerate(r_struct.items):
-                for i, j in enumerate(r_struct.attrs):
-                    val = getattr(item, j)
-                    rows.append(
-                        (
-                            f"{string.ascii_uppercase[i]}{str(start + a + 1)}",
-                            val,
-                        )
-                    )
-            self.__sheets.append((rows, r_struct.title))
 
     def binary(self):
-        """Prepare binary stream object.
-
-        Requires a rows (cell data to be written in tuple (cell, data))
-        That is prepared into Excel file and returned as binary file-
-        object.
-        """
-        excel = openpyxl.Workbook()
-        first = True
-        for sheet in self.__sheets:
-            if first:
-                ws_sheet = excel.active
-                ws_sheet.title = sheet[1]
-                first = False
-            else:
-                ws_sheet = excel.create_sheet(title=sheet[1])
-            for cell in sheet[0]:
-                ws_sheet[cell[0]].value = cell[1]
-        tmp = io.BytesIO()
-        excel.save(tmp)
-        tmp.seek(0)
-        excel_bytes = tmp.read()
-        tmp.close()
-        return excel_bytes
+        """Return Excel file as bytes."""
+        excel = openpyxl.Workbook(write_only=True)
+        for r_struct in self.__r_structs:
+            ws_sheet = excel.create_sheet(title=r_struct.title)
+            for row in get_excel_rows(r_struct):
+                ws_sheet.append(row)
+        with tempfile.SpooledTemporaryFile(self.spool_size) as tmp:
+            excel.save(tmp)
+            tmp.seek(0)
+            return tmp.read()
 
 
 def get_excel(content):
@@ -1,20 +1,89 @@
 """Holds all memory data structures used by accountant."""
 
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import dataclasses as data
 from dataclasses import dataclass
 import datetime
+import decimal
 import hashlib
+import numbers
+import os
+import stat
 import uuid
 
 import membank
+import sqlalchemy as sa
 
+from . import reconcile, sql
 
 DEFAULT_CAR_PLATE = "XX0000"
 DEFAULT_CAR_ODO_KM = 0
+BALANCE_EPOCH = datetime.date(year=2000, month=1, day=1)
+BALANCE_SIZE = 2**16  # Days from BALANCE_EPOCH covered by balances
+MMAP_SIZE = 2**28  # Bytes of closed fiscal year files read memory-mapped
 PARTNER_ACCOUNTS = (
     2310,
     5310,
 )  # Accounts that are observed for partner matching
+MONEY_FIELDS = (
+    "debit_amount",
+    "credit_amount",
+    "deal_value",
+    "debit_stack",
+    "credit_stack",
+)  # Transaction fields kept as Money
+
+
+class Money(int):
+    """Exact amount of money in integer cents.
+
+    Money is created from integer cents, amounts in units of currency go
+    through from_units and any other type is refused, so the unit never
+    depends on the type of value. Arithmetic is plain int arithmetic on
+    cents.
+
+    >>> Money(1250) == Money.from_cents(1250.0) == Money.from_units("12.50")
+    True
+    >>> Money(1250).units()
+    12.5
+    """
+
+    def __new__(cls, value=0):
+        """Create from integer cents, otherwise raise TypeError."""
+        if not isinstance(value, numbers.Integral):
+            raise TypeError(
+                f"Money takes integer cents, not {type(value).__name__},"
+                " use Money.from_units or Money.from_cents"
+            )
+        return super().__new__(cls, value)
+
+    @classmethod
+    def from_cents(cls, value):
+        """Create from whole number of cents of any numeric type."""
+        if value != int(value):
+            raise ValueError(f"Cents must be whole, got {value}")
+        return cls(int(value))
+
+    @classmethod
+    def from_units(cls, value):
+        """Create from units of currency rounded half up to cents."""
+        value = decimal.Decimal(str(value)).scaleb(2)
+        return cls(int(value.quantize(1, rounding=decimal.ROUND_HALF_UP)))
+
+    def units(self):
+        """Return amount in units of currency."""
+        return int(self) / 100
+
+    def __repr__(self):
+        """Represent amount in cents."""
+        return f"Money({int(self)})"
+
+    def __str__(self):
+        """Format amount in units of currency."""
+        return f"{self.units():.2f}"
 
 
 @dataclass
@@ -39,14 +108,14 @@ class ChatSubjectLookup:
 class Booking:
     """Automates accounting transactions.
 
-    Decides debit and credit accounts Reassigns correctly closing
-    balances also on impacted transactions already stored.
+    Decides debit and credit accounts and registers movements on both
+    accounts in BalanceIndex. Amounts not given as Money are units of
+    currency.
     """
 
     def __init__(self, text, memory, **kargs):
         """Text value decides what booking will it be."""
         self.memory = memory
-        self.comp = self.memory.transaction
         self.load_records()
         text = text.lower()
         splitter = text.find(":")
@@ -61,7 +130,13 @@ class Booking:
                 acc_pair.insert(0, set_acc)
         kargs["debit"] = self.records[text][0]
         kargs["credit"] = self.records[text][1]
+        amount = kargs.get("debit_amount")
+        for name in MONEY_FIELDS:
+            if name in kargs and not isinstance(kargs[name], Money):
+                kargs[name] = Money.from_units(kargs[name])
         self.transaction = Transaction(**kargs)
+        if "id" not in kargs and not isinstance(amount, Money):
+            self.transaction.id = get_transaction_id(self.transaction, amount)
         self.matched_deals = []
 
     def load_records(self):
@@ -89,153 +164,294 @@ class Booking:
             "asset-depreciate": (7420, 1290),
         }
 
-    def correct_balances(self, node):
-        """Apply closing balance recalculations."""
-        if not node.right:
+    def get_open_key(self):
+        """Return key of open items queue transaction can match or None."""
+        item = self.transaction
+        if item.credit in PARTNER_ACCOUNTS:
+            side, account, currency = "debit", item.credit, item.credit_currency
+        elif item.debit in PARTNER_ACCOUNTS:
+            side, account, currency = "credit", item.debit, item.debit_currency
+        else:
+            return None
+        return (side, account, currency, item.partner, item.date.year)
+
+    def match_deals(self, open_items, preferred=()):
+        """Check if other leg of deal is present, if so matches those.
+
+        Preferred deals are matched first, then open items of the queue
+        first in first out. Preferred deals left open return to queue.
+        """
+        key = self.get_open_key()
+        if not key:
             return
-        next_node = self.memory.get.node(transaction=node.right)
-        next_node.closing = round(node.closing + next_node.value, 2)
-        self.memory.put(next_node)
-        self.correct_balances(next_node)
-
-    def match_deals(self):
-        """Check if other leg of deal is present, if so matches those."""
-        to_check = self.transaction
-        partner_match = [2310, 5310]
-        last_year = datetime.date(year=to_check.date.year - 1, month=12, day=31)
-        next_year = datetime.date(year=to_check.date.year + 1, month=1, day=1)
-        args = [
-            self.comp.partner == to_check.partner,
-            self.comp.date > last_year,
-            self.comp.date < next_year,
-        ]
-        if to_check.credit in partner_match:
-            args.append(self.comp.debit == to_check.credit)
-            args.append(self.comp.debit_currency == to_check.credit_currency)
-            args.append(self.comp.debit_stack > 0)
-            orphan_deals = self.memory.get(*args)
-            self.make_match(orphan_deals, side="debit")
-        elif to_check.debit in partner_match:
-            args.append(self.comp.credit == to_check.debit)
-            args.append(self.comp.credit_currency == to_check.debit_currency)
-            args.append(self.comp.credit_stack > 0)
-            orphan_deals = self.memory.get(*args)
-            self.make_match(orphan_deals, side="credit")
+        matched_deals = []
+        if preferred:
+            self.make_match(collections.deque(preferred), side=key[0])
+            matched_deals = self.matched_deals
+            for deal in preferred:
+                if getattr(deal, key[0] + "_stack") > 0:
+                    open_items.insert(key, deal)
+        self.make_match(open_items.get(*key), side=key[0])
+        self.matched_deals = matched_deals + self.matched_deals
 
     def make_match(self, orphan_deals, side="debit"):
-        """Do a match for a to_check transaction."""
+        """Do a match for a to_check transaction.
+
+        Orphan deals is a queue of open items ordered by date. Deals are
+        matched first in first out and fully matched deals are removed
+        from the queue.
+        """
         check = self.transaction
-        orphan_deals.sort(key=lambda x: x.date)
+        deal_stack = side + "_stack"
+        check_stack = "credit_stack" if side == "debit" else "debit_stack"
         matched_deals = []
-        for deal in orphan_deals:
-            if side == "debit":
-                deal_stack = "debit_stack"
-                check_stack = "credit_stack"
-            else:
-                deal_stack = "credit_stack"
-                check_stack = "debit_stack"
+        while orphan_deals:
+            deal = orphan_deals[0]
             deal_side = getattr(deal, deal_stack)
             check_side = getattr(check, check_stack)
-            if deal_side >= check_side:
-                setattr(deal, deal_stack, round(deal_side - check_side, 2))
-                setattr(check, check_stack, 0)
-                self.memory.put(deal)
-                matched_deals.append(deal)
+            if deal_side <= 0:
+                orphan_deals.popleft()
+                continue
+            if check_side <= 0:
                 break
-            setattr(check, check_stack, round(check_side - deal_side, 2))
-            setattr(deal, deal_stack, 0)
-            self.memory.put(deal)
             matched_deals.append(deal)
+            if deal_side > check_side:
+                setattr(deal, deal_stack, Money(deal_side - check_side))
+                setattr(check, check_stack, Money(0))
+                break
+            setattr(check, check_stack, Money(check_side - deal_side))
+            setattr(deal, deal_stack, Money(0))
+            orphan_deals.popleft()
         self.matched_deals = matched_deals
 
-    def convert_currency(self):
-        """Handle Upwork currency exchange."""
+    def convert_currency(self, open_items):
+        """Handle Upwork currency exchange.
+
+        Return list of bookings on exchange margin and commission.
+        """
         item = self.transaction
         mem = self.memory
-        if item.debit_currency != item.credit_currency:
-            invoices_not_paid = mem.get(
-                mem.transaction.credit == 6110,
-                mem.transaction.credit_currency == "USD",
-                mem.transaction.credit_stack > 0,
-            )
-            self.make_match(invoices_not_paid, side="credit")
-            t_eur = [
-                (i.credit_amount - i.credit_stack) / i.rate
-                for i in self.matched_deals
-            ]
-            fx_margin = sum(t_eur) - item.deal_value
-            fx_trans = {"date": item.date}
-            fx_trans["source"] = item.source
-            fx_booking = dict(fx_trans)
-            fx_booking["reference"] = item.date.isoformat() + "fx_margin"
-            fx_booking["comment"] = item.comment
-            fx_booking["debit_amount"] = round(abs(fx_margin), 2)
-            if fx_margin > 0:
-                fx_type = "fx-profit"
-            else:
-                fx_type = "fx-loss"
-            fx_booking = Booking(fx_type, mem, **fx_booking)
-            fx_booking.save()
-            fx_commission = dict(fx_trans)
-            fx_commission["debit_amount"] = round(
-                item.deal_value - item.credit_amount, 2
-            )
-            fx_commission["reference"] = item.reference + "fx_commission"
-            fx_commission["comment"] = "upwork fx commission"
-            fx_commission = Booking("upwork-commission", mem, **fx_commission)
-            fx_commission.save()
+        if item.debit_currency == item.credit_currency:
+            return []
+        invoices_not_paid = open_items.get("credit", 6110, "USD")
+        self.make_match(invoices_not_paid, side="credit")
+        t_eur = [
+            (i.credit_amount - i.credit_stack) / i.rate
+            for i in self.matched_deals
+        ]
+        fx_margin = round(sum(t_eur)) - item.deal_value
+        fx_trans = {"date": item.date}
+        fx_trans["source"] = item.source
+        fx_booking = dict(fx_trans)
+        fx_booking["reference"] = item.date.isoformat() + "fx_margin"
+        fx_booking["comment"] = item.comment
+        fx_booking["debit_amount"] = Money(abs(fx_margin))
+        if fx_margin > 0:
+            fx_type = "fx-profit"
+        else:
+            fx_type = "fx-loss"
+        fx_booking = Booking(fx_type, mem, **fx_booking)
+        fx_commission = dict(fx_trans)
+        fx_commission["debit_amount"] = Money(
+            item.deal_value - item.credit_amount
+        )
+        fx_commission["reference"] = item.reference + "fx_commission"
+        fx_commission["comment"] = "upwork fx commission"
+        fx_commission = Booking("upwork-commission", mem, **fx_commission)
+        return [fx_booking, fx_commission]
 
     def save(self):
         """Save transaction into memory."""
-        to_save = self.transaction
-        booking = self.memory.get(
-            "transaction",
-            date=to_save.date,
-            reference=to_save.reference,
-            debit_amount=to_save.debit_amount,
-            debit=to_save.debit,
-            credit=to_save.credit,
+        writer = LedgerWriter(self.memory)
+        writer.add(self)
+        writer.commit()
+
+
+class OpenItems:
+    """Index of deals in memory with stacks not yet matched.
+
+    Open items are kept in queues ordered by date, one queue per side,
+    account, currency, partner and year. Deals on PARTNER_ACCOUNTS are
+    kept for their partner and year, unpaid invoices on 6110 are kept
+    for any partner and year. Booking.make_match removes fully matched
+    deals from the queue, so a match costs the number of deals it
+    consumes.
+    """
+
+    def __init__(self, memory):
+        """Initialise with memory access."""
+        self.memory = memory
+        self.queues = {}
+
+    def load(self, transactions):
+        """Load open items that transactions might match in one query."""
+        table = sql.get_table(self.memory, Transaction)
+        if table is None or not transactions:
+            return
+        col = table.c
+        partners = list({i.partner for i in transactions})
+        years = [i.date.year for i in transactions]
+        where = (
+            col.partner.in_(partners)
+            & (col.date >= datetime.date(year=min(years), month=1, day=1))
+            & (col.date < datetime.date(year=max(years) + 1, month=1, day=1))
+            & (
+                (col.debit.in_(PARTNER_ACCOUNTS) & (col.debit_stack > 0))
+                | (col.credit.in_(PARTNER_ACCOUNTS) & (col.credit_stack > 0))
+            )
         )
-        if not booking:
-            self.convert_currency()
-            self.match_deals()
-            comp = self.memory.transaction
-            sides = (
-                (
-                    comp.debit == to_save.debit,
-                    to_save.debit,
-                    to_save.debit_amount,
-                ),
-                (
-                    comp.credit == to_save.credit,
-                    to_save.credit,
-                    -to_save.debit_amount,
-                ),
+        if any(i.debit_currency != i.credit_currency for i in transactions):
+            where |= (
+                (col.credit == 6110)
+                & (col.credit_currency == "USD")
+                & (col.credit_stack > 0)
             )
-            for side in sides:
-                node = Node(
-                    transaction=to_save.id,
-                    account=side[1],
-                    value=side[2],
-                    closing=side[2],
-                )
-                prev_booking = self.memory.get(
-                    comp.date <= to_save.date, side[0]
-                )
-                prev_booking = sorted(prev_booking, key=lambda x: x.date)
-                if prev_booking:
-                    prev_node = self.memory.get.node(
-                        transaction=prev_booking[0].id
-                    )
-                    node.closing += prev_node.closing
-                    node.left = prev_node.transaction
-                    if prev_node.right and prev_node.rigth != node.transaction:
-                        node.right = prev_node.right
-                        self.correct_balances(node)
-                        prev_node.right = node.transaction
-                        self.memory.put(prev_node)
-                self.memory.put(node)
-            self.memory.put(to_save)
+        order = (col.date, col.id)
+        for item in sql.select(self.memory, Transaction, where, order_by=order):
+            self.add(item)
+
+    def add(self, item):
+        """Add transaction to queues where it has a stack to match."""
+        for side in ("debit", "credit"):
+            account = getattr(item, side)
+            currency = getattr(item, side + "_currency")
+            if getattr(item, side + "_stack") <= 0:
+                continue
+            if account in PARTNER_ACCOUNTS:
+                key = (side, account, currency, item.partner, item.date.year)
+            elif side == "credit" and account == 6110:
+                key = (side, account, currency, None, None)
+            else:
+                continue
+            self.insert(key, item)
+
+    def insert(self, key, item):
+        """Insert transaction into queue of key in date order."""
+        queue = self.queues.setdefault(key, collections.deque())
+        if not queue or queue[-1].date <= item.date:
+            queue.append(item)
+        else:
+            dates = [i.date for i in queue]
+            queue.insert(bisect.bisect_right(dates, item.date), item)
+
+    def get(self, side, account, currency, partner=None, year=None):
+        """Return queue of open items ordered by date."""
+        key = (side, account, currency, partner, year)
+        return self.queues.setdefault(key, collections.deque())
+
+
+class LedgerWriter:
+    """Saves many bookings into memory at once.
+
+    Bookings are saved in date order. Duplicates are checked against
+    stored ids read in one query, deals are matched against open items
+    loaded in one query and all changes are written in one database
+    transaction together with events of booked and matched transactions.
+    With reconcile, bookings are first joined with open items they
+    match by amount, reference or text, see reconcile.get_match_plan.
+
+    >>> writer = LedgerWriter(memory)
+    >>> writer.add(Booking("seb-expense", memory, **kargs))
+    >>> writer.commit()
+    """
+
+    def __init__(self, memory, reconcile=False):
+        """Initialise with memory access."""
+        self.memory = memory
+        self.reconcile = reconcile
+        self.plan = {}
+        self.bookings = []
+        self.known = set()
+        self.changes = {}
+        self.open_items = OpenItems(memory)
+        self.index = BalanceIndex(memory)
+
+    def add(self, booking):
+        """Add booking to be saved on commit."""
+        self.bookings.append(booking)
+
+    def commit(self):
+        """Save all added bookings."""
+        bookings = sorted(self.bookings, key=lambda x: x.transaction.date)
+        self.bookings = []
+        transactions = [i.transaction for i in bookings]
+        self.known = sql.select_keys(
+            self.memory, Transaction, [i.id for i in transactions]
+        )
+        self.changes = {}
+        self.open_items = OpenItems(self.memory)
+        self.open_items.load(transactions)
+        FiscalYears(self.memory).check_open({i.date.year for i in transactions})
+        self.plan = {}
+        if self.reconcile:
+            new = {i.transaction.id: i for i in bookings}
+            new = [v for i, v in new.items() if i not in self.known]
+            self.plan = reconcile.get_match_plan(new, self.open_items)
+        for booking in bookings:
+            self.book(booking)
+        items = list(self.changes.values()) + self.index.get_changes()
+        log = EventLog(self.memory)
+        events = log.get_events("transaction", self.changes.values())
+        missing = [Transaction, Balance]
+        missing = [i for i in missing if sql.get_table(self.memory, i) is None]
+        sql.put_many(self.memory, items, appended=events)
+        for cls in missing:
+            sql.create_indexes(self.memory, cls, indexes[cls])
+
+    def book(self, booking):
+        """Book transaction unless it is a duplicate."""
+        item = booking.transaction
+        if item.id in self.known:
+            return
+        self.known.add(item.id)
+        fx_bookings = booking.convert_currency(self.open_items)
+        self.changes.update((i.id, i) for i in booking.matched_deals)
+        booking.match_deals(self.open_items, self.plan.get(item.id, ()))
+        self.changes.update((i.id, i) for i in booking.matched_deals)
+        self.index.add(item.debit, item.date, item.debit_amount)
+        self.index.add(item.credit, item.date, -item.debit_amount)
+        self.changes[item.id] = item
+        self.open_items.add(item)
+        for fx_booking in fx_bookings:
+            self.book(fx_booking)
+
+
+def put_transactions(memory, items=(), deleted=()):
+    """Save and delete transactions in one database transaction.
+
+    Stored versions of items and deleted are read in one query. Their
+    movements are reversed in BalanceIndex and movements of items are
+    added, so balances change by the difference in the same write as
+    transactions and their events. Raise RuntimeWarning if any of them
+    is dated in a closed fiscal year.
+    """
+    items = list(items)
+    deleted = list(deleted)
+    stored = {}
+    table = sql.get_table(memory, Transaction)
+    ids = [i.id for i in items + deleted]
+    if table is not None and ids:
+        for chunk in sql.get_chunks(ids):
+            found = sql.select(memory, Transaction, table.c.id.in_(chunk))
+            stored.update((i.id, i) for i in found)
+    years = {i.date.year for i in items + list(stored.values())}
+    FiscalYears(memory).check_open(years)
+    index = BalanceIndex(memory)
+    for item in stored.values():
+        index.add(item.debit, item.date, -item.debit_amount)
+        index.add(item.credit, item.date, item.debit_amount)
+    for item in items:
+        index.add(item.debit, item.date, item.debit_amount)
+        index.add(item.credit, item.date, -item.debit_amount)
+    deleted = [i for i in deleted if i.id in stored]
+    log = EventLog(memory)
+    events = log.get_events("transaction", items)
+    events += log.get_events("delete", deleted)
+    missing = [Transaction, Balance]
+    missing = [i for i in missing if sql.get_table(memory, i) is None]
+    sql.put_many(memory, items + index.get_changes(), deleted, events)
+    for cls in missing:
+        sql.create_indexes(memory, cls, indexes[cls])
 
 
 @dataclass
@@ -349,15 +565,178 @@ class Address:
 
 
 @dataclass
-class Node:
-    """Node that keeps balances on accounts."""
+class Balance:
+    """Node of Fenwick tree that keeps running balance of an account.
+
+    Position is a day number counted from BALANCE_EPOCH, value is a sum
+    in cents of account movements over the range of days the node is
+    responsible for.
+    """
 
-    transaction: str
     account: int
-    value: float
-    closing: float
-    left: str = ""
-    right: str = ""
+    position: int
+    value: int
+    id: str = data.field(default=None, metadata={"key": True})
+
+    def __post_init__(self):
+        """Add unique id from account and position."""
+        if not self.id:
+            self.id = f"{self.account}:{self.position}"
+
+
+def get_balance_position(date):
+    """Return Fenwick tree position of a date."""
+    position = (date - BALANCE_EPOCH).days + 1
+    if not 0 < position <= BALANCE_SIZE:
+        raise RuntimeWarning(f"Date {date} is out of balance index range")
+    return position
+
+
+def get_prefix_positions(date):
+    """Return positions of nodes that sum to closing balance at date."""
+    positions = []
+    position = get_balance_position(date)
+    while position > 0:
+        positions.append(position)
+        position -= position & -position
+    return positions
+
+
+def get_balance_tree(movements):
+    """Return Fenwick tree nodes built from movements of one account.
+
+    Movements is a list of (position, value) tuples. Tree is built in
+    one sweep over all positions and returned as dict of position and
+    value of nodes that are not zero.
+    """
+    tree = [0] * (BALANCE_SIZE + 1)
+    for position, value in movements:
+        tree[position] += value
+    for position in range(1, BALANCE_SIZE + 1):
+        parent = position + (position & -position)
+        if parent <= BALANCE_SIZE:
+            tree[parent] += tree[position]
+    return {i: j for i, j in enumerate(tree) if j}
+
+
+class BalanceIndex:
+    """Running balances of accounts.
+
+    Each account is a Fenwick tree over day numbers stored in Balance
+    memory. Booking a movement on any date updates and reading a balance
+    as of any date reads at most log2(BALANCE_SIZE) nodes.
+    """
+
+    def __init__(self, memory):
+        """Initialise with memory access."""
+        self.memory = memory
+        self.movements = {}
+
+    def add(self, account, date, value):
+        """Register movement on account for the date."""
+        position = get_balance_position(date)
+        while position <= BALANCE_SIZE:
+            key = (account, position)
+            self.movements[key] = self.movements.get(key, 0) + value
+            position += position & -position
+
+    def get_changes(self):
+        """Return list of Balance nodes with registered movements applied.
+
+        Stored nodes are read in one query, registered movements are
+        cleared afterwards.
+        """
+        nodes = {}
+        table = sql.get_table(self.memory, Balance)
+        if table is not None and self.movements:
+            ids = [f"{acc}:{pos}" for acc, pos in self.movements]
+            for chunk in sql.get_chunks(ids):
+                stored = sql.select(self.memory, Balance, table.c.id.in_(chunk))
+                for node in stored:
+                    nodes[(node.account, node.position)] = node
+        for key, value in self.movements.items():
+            node = nodes.setdefault(key, Balance(*key, 0))
+            node.value += value
+        self.movements = {}
+        return list(nodes.values())
+
+    def rebuild(self, accounts=None, max_workers=None):
+        """Rebuild balances of accounts from stored transactions.
+
+        If accounts are not given, balances of all accounts are rebuilt.
+        Transactions are read in one query per closed fiscal year and one
+        for open years and nodes are written back in one bulk write.
+        Accounts are independent of each other, so trees of several
+        accounts are built in a pool of processes.
+        """
+        if sql.get_table(self.memory, Transaction) is None:
+            return
+        if accounts is not None:
+            accounts = list(accounts)
+
+        def where(table):
+            """Return where clauses of accounts on table of a year."""
+            if accounts is None:
+                return ()
+            col = table.c
+            return (col.debit.in_(accounts) | col.credit.in_(accounts),)
+
+        rows = FiscalYears(self.memory).select_all_rows(
+            ("date", "debit", "credit", "debit_amount"), where
+        )
+        movements = {i: [] for i in accounts} if accounts else {}
+        for date, debit, credit, amount in rows:
+            position = get_balance_position(date)
+            movements.setdefault(debit, []).append((position, amount))
+            movements.setdefault(credit, []).append((position, -amount))
+        if accounts is not None:
+            movements = {i: movements[i] for i in accounts}
+        if len(movements) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+                trees = list(pool.map(get_balance_tree, movements.values()))
+        else:
+            trees = [get_balance_tree(i) for i in movements.values()]
+        nodes = []
+        for account, tree in zip(movements, trees):
+            nodes += [Balance(account, *i) for i in tree.items()]
+        where = []
+        table = sql.get_table(self.memory, Balance)
+        if accounts is not None and table is not None:
+            where.append(table.c.account.in_(accounts))
+        sql.replace(self.memory, Balance, nodes, *where)
+
+    def get_balance(self, account, date):
+        """Return closing balance of account at the end of the date."""
+        table = sql.get_table(self.memory, Balance)
+        if table is None:
+            return Money(0)
+        nodes = sql.select(
+            self.memory,
+            Balance,
+            table.c.account == account,
+            table.c.position.in_(get_prefix_positions(date)),
+        )
+        return Money(sum(i.value for i in nodes))
+
+    def get_balances(self, date):
+        """Return dict of non-zero closing balances of accounts at date.
+
+        Prefix positions of a date are the same for every account, so
+        balances of all accounts are read in one query.
+        """
+        table = sql.get_table(self.memory, Balance)
+        if table is None:
+            return {}
+        rows = sql.select_rows(
+            self.memory,
+            Balance,
+            ("account", "value"),
+            table.c.position.in_(get_prefix_positions(date)),
+        )
+        balances = collections.defaultdict(int)
+        for account, value in rows:
+            balances[account] += value
+        return {i: Money(v) for i, v in sorted(balances.items()) if v}
 
 
 @dataclass
@@ -368,6 +747,50 @@ class Account:
     name: str
 
 
+@dataclass
+class AccountBalance:
+    """Closing balance of account in trial balance."""
+
+    account: int
+    name: str
+    balance: int
+
+
+@dataclass
+class StatementRow:
+    """Rolled up balance of account, group or class in statements."""
+
+    code: str
+    name: str
+    balance: int
+
+
+@dataclass
+class AgingRow:
+    """Open stacks of partner on account by days overdue."""
+
+    partner: str
+    account: int
+    days_0_30: int
+    days_31_60: int
+    days_61_90: int
+    days_over_90: int
+    total: int
+
+
+AGING_FIELDS = ("days_0_30", "days_31_60", "days_61_90", "days_over_90")
+
+
+@dataclass
+class VatRow:
+    """VAT relevant totals of a period and partner country."""
+
+    period: str
+    country: str
+    sales: int
+    vat: int
+
+
 @dataclass
 class Currency:
     """Currencies and their rates with EUR."""
@@ -377,6 +800,15 @@ class Currency:
     rate: float
 
 
+@dataclass
+class Rate:
+    """ECB reference rate of currency with EUR published on date."""
+
+    date: datetime.date
+    currency: str
+    rate: float
+
+
 @dataclass
 class Sequences:
     """Generic sequences."""
@@ -395,42 +827,62 @@ class TransactionAttachment:
     blob: bytes
 
 
+def get_transaction_id(item, amount):
+    """Return unique id of transaction hashed with amount in units.
+
+    Amount is hashed in text of the value as given, so ids stay those
+    of earlier versions that kept amounts as given, for example "15"
+    of integer and "15.0" of float units.
+    """
+    new_id = hashlib.sha1()
+    byte_string = item.date.strftime("%Y%m%d").encode()
+    byte_string += item.reference.encode()
+    byte_string += str(amount).encode()
+    byte_string += str(item.debit_currency).encode()
+    byte_string += str(item.credit_currency).encode()
+    byte_string += str(item.debit).encode()
+    byte_string += str(item.credit).encode()
+    new_id.update(byte_string)
+    return new_id.hexdigest()
+
+
 @dataclass
 class Transaction:
-    """Transactions in General Ledger."""
+    """Transactions in General Ledger.
+
+    Amounts, stacks and deal value are Money stored as integer cents.
+    Integers given for them are taken as cents, other types are refused,
+    see Money.from_units.
+    """
 
     date: datetime.date
     reference: str
     source: str
     comment: str
-    debit_amount: float
-    credit_amount: float = 0
+    debit_amount: int
+    credit_amount: int = 0
     partner: str = ""
     debit: int = 0
     credit: int = 0
-    deal_value: float = 0
+    deal_value: int = 0
     rate: float = 1
     debit_currency: str = "EUR"
     credit_currency: str = "EUR"
-    debit_stack: float = -1
-    credit_stack: float = -1
+    debit_stack: int = -1
+    credit_stack: int = -1
     id: str = data.field(default=None, metadata={"key": True})
 
     def __post_init__(self):
         """Add unique id to transaction."""
+        if isinstance(self.date, datetime.datetime):
+            self.date = self.date.date()
+        for name in MONEY_FIELDS:
+            if not isinstance(getattr(self, name), Money):
+                setattr(self, name, Money(getattr(self, name)))
         if not self.id:
-            new_id = hashlib.sha1()
-            byte_string = self.date.strftime("%Y%m%d").encode()
-            byte_string += self.reference.encode()
-            byte_string += str(self.debit_amount).encode()
-            byte_string += str(self.debit_currency).encode()
-            byte_string += str(self.credit_currency).encode()
-            byte_string += str(self.debit).encode()
-            byte_string += str(self.credit).encode()
-            new_id.update(byte_string)
-            self.id = new_id.hexdigest()
+            self.id = get_transaction_id(self, self.debit_amount.units())
         if not self.deal_value:
-            self.deal_value = round(self.debit_amount / self.rate, 2)
+            self.deal_value = Money(round(self.debit_amount / self.rate))
         if not self.credit_amount:
             self.credit_amount = self.debit_amount
         if self.debit_stack == -1:
@@ -439,6 +891,267 @@ class Transaction:
             self.credit_stack = self.credit_amount
 
 
+@dataclass
+class Event:
+    """Entry of append-only log of ledger mutations.
+
+    Kind is one of EVENT_KINDS and item holds JSON values of the
+    mutated memory, see EventLog.
+    """
+
+    position: int = data.field(metadata={"key": True})
+    kind: str
+    item: dict
+
+
+EVENT_KINDS = ("transaction", "delete", "trip", "sequence")
+
+
+def get_event_item(item):
+    """Return JSON values of dataclass item."""
+    values = {}
+    for name, value in sql.get_values(item).items():
+        if isinstance(value, datetime.date):
+            value = value.strftime("%Y-%m-%d")
+        elif isinstance(value, Money):
+            value = int(value)
+        values[name] = value
+    return values
+
+
+class EventLog:
+    """Append-only log of mutations of ledger memories.
+
+    Saved or updated transactions, deleted transactions, trips and
+    sequences are logged. Transactions are logged again with new stacks
+    whenever they are matched, so replay restores matches as decided
+    by reconciliation. Balances and car mileage are derived from them
+    and not logged, see brain.ledger.replay_events.
+
+    Events are appended through sql.put_many, that numbers them after
+    the last logged event in the write itself, so events of writers
+    that overlap are logged one after another and never overwritten.
+
+    >>> log = EventLog(memory)
+    >>> log.append("transaction", [transaction])
+    >>> for event in log.stream(): ...
+    """
+
+    def __init__(self, memory):
+        """Initialise with memory access."""
+        self.memory = memory
+        self.position = None
+
+    def get_position(self):
+        """Return position of last logged event or 0."""
+        table = sql.get_table(self.memory, Event)
+        if table is None:
+            return 0
+        rows = sql.select_rows(
+            self.memory,
+            Event,
+            ("position",),
+            order_by=(table.c.position.desc(),),
+            limit=1,
+        )
+        return rows[0][0] if rows else 0
+
+    def get_events(self, kind, items):
+        """Return events of kind for items to be appended with them.
+
+        Positions follow those of earlier events of this log and are
+        set again when events are appended with sql.put_many.
+        """
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"Unknown event kind '{kind}'")
+        if self.position is None:
+            self.position = self.get_position()
+        events = []
+        for item in items:
+            self.position += 1
+            events.append(Event(self.position, kind, get_event_item(item)))
+        return events
+
+    def append(self, kind, items):
+        """Log events of kind for items."""
+        sql.put_many(self.memory, (), appended=self.get_events(kind, items))
+
+    def stream(self, size=sql.CHUNK_SIZE):
+        """Yield logged events in order reading size events at once."""
+        table = sql.get_table(self.memory, Event)
+        if table is None:
+            return
+        position = 0
+        while True:
+            events = sql.select(
+                self.memory,
+                Event,
+                table.c.position > position,
+                order_by=(table.c.position,),
+                limit=size,
+            )
+            yield from events
+            if len(events) < size:
+                return
+            position = events[-1].position
+
+
+@dataclass
+class ClosedYear:
+    """Fiscal year with transactions moved into database file of its own."""
+
+    year: int = data.field(metadata={"key": True})
+    path: str
+
+
+class FiscalYears:
+    """Ledger partitioned by fiscal year.
+
+    Closing a fiscal year moves its transactions from transaction table
+    into database file of that year next to main database file. The file
+    is made read-only and attached memory-mapped only while a query of
+    that year runs. Queries of open years touch only open transactions
+    and files of closed years can be backed up or vacuumed on their own.
+
+    Where clauses of a year are built on table of that year.
+
+    >>> years = FiscalYears(memory)
+    >>> years.close(2021)
+    >>> table = years.get_table(2021)
+    >>> years.select(2021, table.c.debit == 2310)
+    """
+
+    def __init__(self, memory):
+        """Initialise with memory access and closed years read at once."""
+        self.memory = memory
+        self.closed = dict(
+            sql.select_rows(memory, ClosedYear, ("year", "path"))
+        )
+        self.metadata = sa.MetaData()  # Tables of closed years
+
+    @staticmethod
+    def get_schema(year):
+        """Return schema name of attached database file of year."""
+        return f"year{int(year)}"
+
+    def get_path(self, year):
+        """Return path of database file of year next to main file."""
+        database = sql.get_engine(self.memory).url.database
+        if not database or database == ":memory:":
+            raise RuntimeWarning("Fiscal years can be closed only in a file")
+        root, ext = os.path.splitext(database)
+        return f"{root}-{year}{ext}"
+
+    def get_table(self, year):
+        """Return table holding transactions of year or None."""
+        table = sql.get_table(self.memory, Transaction)
+        if year not in self.closed or table is None:
+            return table
+        schema = self.get_schema(year)
+        key = f"{schema}.{table.name}"
+        if key not in self.metadata.tables:
+            table.to_metadata(self.metadata, schema=schema)
+        return self.metadata.tables[key]
+
+    @contextlib.contextmanager
+    def connect(self, year):
+        """Yield connection with database file of year attached if closed."""
+        with sql.get_engine(self.memory).connect() as conn:
+            if year not in self.closed:
+                yield conn
+                return
+            schema = self.get_schema(year)
+            conn.exec_driver_sql(
+                f"ATTACH DATABASE ? AS {schema}", (self.closed[year],)
+            )
+            conn.exec_driver_sql(f"PRAGMA {schema}.mmap_size = {MMAP_SIZE}")
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+                conn.exec_driver_sql(f"DETACH DATABASE {schema}")
+
+    def select_rows(self, year, names, *where, order_by=(), limit=None):
+        """Return list of row tuples of year like sql.select_rows."""
+        table = self.get_table(year)
+        if table is None:
+            return []
+        stmt = sql.get_statement(
+            table, names, *where, order_by=order_by, limit=limit
+        )
+        with self.connect(year) as conn:
+            return [tuple(row) for row in conn.execute(stmt)]
+
+    def select(self, year, *where, order_by=(), limit=None):
+        """Return list of transactions of year matching where clauses."""
+        names = [i.name for i in data.fields(Transaction)]
+        rows = self.select_rows(
+            year, names, *where, order_by=order_by, limit=limit
+        )
+        return [Transaction(*row) for row in rows]
+
+    def select_all_rows(self, names, where=None):
+        """Return row tuples of closed years and then of open years.
+
+        Where is a function returning where clauses built on table of a
+        year, there is one query per closed year and one for open years.
+        """
+        rows = []
+        for year in [*sorted(self.closed), None]:
+            table = self.get_table(year)
+            if table is not None:
+                clauses = where(table) if where else ()
+                rows += self.select_rows(year, names, *clauses)
+        return rows
+
+    def select_all(self, where=None):
+        """Return transactions of all years matching where clauses."""
+        names = [i.name for i in data.fields(Transaction)]
+        return [Transaction(*i) for i in self.select_all_rows(names, where)]
+
+    def check_open(self, years):
+        """Raise RuntimeWarning if any of years is closed."""
+        closed = sorted(set(years) & set(self.closed))
+        if closed:
+            raise RuntimeWarning(f"Fiscal year {closed[0]} is closed")
+
+    def close(self, year):
+        """Move transactions of year into read-only file of that year."""
+        self.check_open([year])
+        if year >= datetime.date.today().year:
+            raise RuntimeWarning(f"Fiscal year {year} is not over yet")
+        table = sql.get_table(self.memory, Transaction)
+        if table is None:
+            raise RuntimeWarning("There are no transactions to close")
+        path = self.get_path(year)
+        if os.path.exists(path):
+            raise RuntimeWarning(f"File of fiscal year exists: {path}")
+        schema = self.get_schema(year)
+        target = table.to_metadata(sa.MetaData(), schema=schema)
+        where = (
+            table.c.date >= datetime.date(year=year, month=1, day=1),
+            table.c.date < datetime.date(year=year + 1, month=1, day=1),
+        )
+        with sql.get_engine(self.memory).connect() as conn:
+            conn.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (path,))
+            conn.commit()
+            try:
+                target.create(conn)
+                conn.execute(
+                    target.insert().from_select(
+                        table.c.keys(), table.select().where(*where)
+                    )
+                )
+                conn.execute(table.delete().where(*where))
+                conn.commit()
+            finally:
+                conn.rollback()
+                conn.exec_driver_sql(f"DETACH DATABASE {schema}")
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        self.memory.put(ClosedYear(year, path))
+        self.closed[year] = path
+
+
 report_table = {
     "ledger": [
         "date",
@@ -480,6 +1193,31 @@ report_table = {
         "text",
         "partner_id",
     ],
+    "trialbalance": [
+        "account",
+        "name",
+        "balance",
+    ],
+    "aging": [
+        "partner",
+        "account",
+        "days_0_30",
+        "days_31_60",
+        "days_61_90",
+        "days_over_90",
+        "total",
+    ],
+    "statement": [
+        "code",
+        "name",
+        "balance",
+    ],
+    "vat": [
+        "period",
+        "country",
+        "sales",
+        "vat",
+    ],
     "tripsummary": [
         "date",
         "receipt_ref",
@@ -493,6 +1231,46 @@ report_table = {
     ],
 }
 
+indexes = {
+    Transaction: [
+        ("partner", "date"),
+        ("debit", "date"),
+        ("credit", "date"),
+        ("credit", "credit_currency", "credit_stack"),
+        ("date", "id"),
+    ],
+    Balance: [
+        ("account", "position"),
+        ("position", "account"),
+    ],
+    Trip: [
+        ("year", "month"),
+    ],
+    PartnerIndex: [
+        ("text",),
+        ("partner_id",),
+    ],
+    Currency: [
+        ("currency", "date"),
+    ],
+    Rate: [
+        ("currency", "date"),
+    ],
+}  # Secondary indexes of memory tables matching their lookups
+
+
+def get_partner_names(memory, ids):
+    """Return dict of partner names by partner ids read in one query."""
+    ids = {i for i in ids if i}
+    table = sql.get_table(memory, Partner)
+    if table is None or not ids:
+        return {}
+    names = {}
+    for chunk in sql.get_chunks(ids):
+        where = table.c.id.in_(chunk)
+        names.update(sql.select_rows(memory, Partner, ("id", "name"), where))
+    return names
+
 
 @dataclass
 class ReportStruct:
@@ -513,10 +1291,23 @@ class ReportStruct:
         if not self.attrs:
             self.attrs = report_table[self.title]
         if self.title in ["ledger", "outstanding"]:
+            names = get_partner_names(memory, (i.partner for i in self.items))
             self.sanitise_item_fields(
                 date=lambda x: x.strftime("%Y-%m-%d"),
-                partner=lambda x: memory.get.partner(id=x).name if x else "",
+                partner=lambda x: names.get(x, x),
+                **{i: Money.units for i in MONEY_FIELDS},
+            )
+        if self.title == "aging":
+            names = get_partner_names(memory, (i.partner for i in self.items))
+            self.sanitise_item_fields(
+                partner=lambda x: names.get(x, x),
+                total=Money.units,
+                **{i: Money.units for i in AGING_FIELDS},
             )
+        if self.title in ["trialbalance", "statement"]:
+            self.sanitise_item_fields(balance=Money.units)
+        if self.title == "vat":
+            self.sanitise_item_fields(sales=Money.units, vat=Money.units)
         if self.title == "tripsummary":
             self.sanitise_item_fields(
                 receipt_litres=lambda x: x if x else "",
@@ -0,0 +1,83 @@
+"""Migrations of data stored by earlier versions of tallybot.
+
+Each migration checks itself whether it is needed, so migrate can be
+called on every start with any database.
+"""
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+import sqlalchemy as sa
+
+from . import sql
+from .memories import (
+    MONEY_FIELDS,
+    Balance,
+    BalanceIndex,
+    Event,
+    EventLog,
+    Sequences,
+    Transaction,
+    Trip,
+    indexes,
+)
+
+
+def migrate_to_cents(memory, cls, names):
+    """Convert amounts stored in Float columns as units to integer cents.
+
+    Values are scaled and columns retyped in one database transaction.
+    """
+    table = sql.get_table(memory, cls)
+    if table is None or not isinstance(table.c[names[0]].type, sa.Float):
+        return
+    with sql.get_engine(memory).begin() as conn:
+        values = {i: sa.func.round(table.c[i] * 100) for i in names}
+        conn.execute(table.update().values(values))
+        operations = Operations(MigrationContext.configure(conn))
+        with operations.batch_alter_table(table.name) as batch:
+            for name in names:
+                batch.alter_column(name, type_=sa.Integer)
+    memory.sync(cls)
+
+
+def start_event_log(memory):
+    """Log memories stored before event log existed as its first events.
+
+    Replay of event log then rebuilds ledger kept by earlier versions.
+    """
+    if sql.get_table(memory, Event) is not None:
+        return
+    log = EventLog(memory)
+    events = []
+    for kind, cls in (
+        ("transaction", Transaction),
+        ("trip", Trip),
+        ("sequence", Sequences),
+    ):
+        if sql.get_table(memory, cls) is not None:
+            events += log.get_events(kind, sql.select(memory, cls))
+    sql.put_many(memory, (), appended=events)
+
+
+def start_balance_index(memory):
+    """Build running balances of ledger kept before BalanceIndex existed.
+
+    Transactions written after the index is built change balances by
+    their movements only, so an empty index would stay wrong.
+    """
+    if sql.get_table(memory, Transaction) is None:
+        return
+    if sql.get_table(memory, Balance) is not None:
+        if sql.select_rows(memory, Balance, ("id",), limit=1):
+            return
+    BalanceIndex(memory).rebuild()
+
+
+def migrate(memory):
+    """Bring stored data up to date with current memory structures."""
+    migrate_to_cents(memory, Transaction, MONEY_FIELDS)
+    migrate_to_cents(memory, Balance, ("value",))
+    start_event_log(memory)
+    start_balance_index(memory)
+    for cls, names in indexes.items():
+        sql.create_indexes(memory, cls, names)
@@ -18,7 +18,7 @@ from zoozl.chatbot import (
     MessagePart,
 )
 
-from . import workers
+from . import migrations, workers
 import logging
 
 log = logging.getLogger(__name__)
@@ -62,6 +62,7 @@ class TallyBot(Interface):
         self.conf = root.conf
         self.db_path = self.conf["tallybot"]["database"]
         self.memory = root.memory
+        migrations.migrate(self.memory)
 
     async def consume(self, package: Package):
         """Handle incoming message."""
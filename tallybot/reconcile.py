@@ -0,0 +1,190 @@
+"""Reconciliation of statement lines with open items.
+
+Statement lines of a batch are joined with open items they can match
+before any booking is saved. Open items of the same side, account,
+currency, partner and year as a line are candidates. Lines are joined
+in four stages, each on lines and items left by the previous one:
+
+1. hash join on open amount of item and amount of line
+2. hash join on item reference and words of line reference and comment
+3. subset of oldest items with open amounts summing to amount of line
+4. fuzzy scores of line text against item text, best pair above
+   FUZZY_SCORE first
+
+Resulting match plan holds items to be matched first per line, the
+rest of line is matched first in first out as before.
+
+>>> plan = get_match_plan(bookings, open_items)
+>>> plan[booking.transaction.id]
+[Transaction(...)]
+"""
+
+import collections
+import functools
+import time
+
+import numpy as np
+
+from . import process, token_set_ratio
+
+FUZZY_SCORE = 85  # Lowest token set ratio of texts of matching pair
+SUBSET_ITEMS = 24  # Most open items searched for subset of one line
+SUBSET_SECONDS = 0.05  # Longest search for subset of one line
+SUBSET_TOTAL_SECONDS = 1  # Longest search for subsets of all lines
+
+
+def get_text(item):
+    """Return text of transaction compared in fuzzy stage."""
+    return f"{item.reference} {item.comment}".lower()
+
+
+def join_amounts(lines, items, side):
+    """Return list of (line, item) pairs with equal open amounts."""
+    line_stack = "credit_stack" if side == "debit" else "debit_stack"
+    index = collections.defaultdict(collections.deque)
+    for item in items:
+        index[getattr(item, side + "_stack")].append(item)
+    pairs = []
+    for line in lines:
+        queue = index.get(getattr(line, line_stack))
+        if queue:
+            pairs.append((line, queue.popleft()))
+    return pairs
+
+
+def join_references(lines, items):
+    """Return list of (line, item) pairs by item reference in line text."""
+    index = {}
+    for item in items:
+        if item.reference:
+            index.setdefault(item.reference.lower(), item)
+    pairs = []
+    for line in lines:
+        for word in get_text(line).split():
+            word = word.strip(".,;:()")
+            if word in index:
+                pairs.append((line, index.pop(word)))
+                break
+    return pairs
+
+
+def get_sums(amounts, target, deadline):
+    """Return dict of index tuples by their sums of amounts up to target.
+
+    Sums are kept once per cent value, so there are at most target + 1
+    of them whatever number of amounts. Raise TimeoutError at deadline.
+    """
+    sums = {0: ()}
+    for i, amount in enumerate(amounts):
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        for total, subset in list(sums.items()):
+            if total + amount <= target:
+                sums.setdefault(total + amount, subset + (i,))
+    return sums
+
+
+def get_subset(amounts, target, deadline):
+    """Return index tuple of amounts summing to target or None.
+
+    Halves of amounts are searched separately and joined on sum (meet
+    in the middle), so search grows with 2 ** (len(amounts) / 2).
+    """
+    half = len(amounts) // 2
+    try:
+        left = get_sums(amounts[:half], target, deadline)
+        right = get_sums(amounts[half:], target, deadline)
+    except TimeoutError:
+        return None
+    for total, subset in left.items():
+        rest = right.get(target - total)
+        if rest is not None and (subset or rest):
+            return subset + tuple(half + i for i in rest)
+    return None
+
+
+def join_subsets(lines, items, side):
+    """Return list of (line, item) pairs of items summing to line amount.
+
+    Oldest SUBSET_ITEMS items not above line amount are searched for
+    each line, one line searching at most SUBSET_SECONDS and all lines
+    at most SUBSET_TOTAL_SECONDS. Lines left are matched by later stages.
+    """
+    line_stack = "credit_stack" if side == "debit" else "debit_stack"
+    used = set()
+    pairs = []
+    end = time.monotonic() + SUBSET_TOTAL_SECONDS
+    for line in lines:
+        if time.monotonic() >= end:
+            break
+        target = getattr(line, line_stack)
+        candidates = [
+            i
+            for i in items
+            if id(i) not in used and 0 < getattr(i, side + "_stack") <= target
+        ][:SUBSET_ITEMS]
+        amounts = [getattr(i, side + "_stack") for i in candidates]
+        deadline = min(time.monotonic() + SUBSET_SECONDS, end)
+        for i in get_subset(amounts, target, deadline) or ():
+            pairs.append((line, candidates[i]))
+            used.add(id(candidates[i]))
+    return pairs
+
+
+def join_fuzzy(lines, items):
+    """Return list of (line, item) pairs of best text scores."""
+    if not lines or not items:
+        return []
+    scores = process.cdist(
+        [get_text(i) for i in lines],
+        [get_text(i) for i in items],
+        scorer=token_set_ratio,
+        score_cutoff=FUZZY_SCORE,
+    )
+    pairs = []
+    rows, cols = set(), set()
+    for pos in np.argsort(-scores, axis=None, kind="stable"):
+        row, col = np.unravel_index(pos, scores.shape)
+        if scores[row, col] < FUZZY_SCORE:
+            break
+        if row in rows or col in cols:
+            continue
+        pairs.append((lines[row], items[col]))
+        rows.add(row)
+        cols.add(col)
+    return pairs
+
+
+def get_match_plan(bookings, open_items):
+    """Return dict of deals to match first by transaction ids of bookings.
+
+    Planned deals are taken out of open item queues, so bookings that
+    are matched first in first out do not consume them.
+    """
+    groups = {}
+    for booking in bookings:
+        key = booking.get_open_key()
+        if key:
+            groups.setdefault(key, []).append(booking.transaction)
+    plan = {}
+    for key, lines in groups.items():
+        queue = open_items.get(*key)
+        items = [i for i in queue if getattr(i, key[0] + "_stack") > 0]
+        used = set()
+        for join in (
+            functools.partial(join_amounts, side=key[0]),
+            join_references,
+            functools.partial(join_subsets, side=key[0]),
+            join_fuzzy,
+        ):
+            pairs = join(lines, items)
+            for line, item in pairs:
+                plan.setdefault(line.id, []).append(item)
+                used.add(id(item))
+            lines = [i for i in lines if i.id not in plan]
+            items = [i for i in items if id(i) not in used]
+        if used:
+            left = [i for i in queue if id(i) not in used]
+            queue.clear()
+            queue.extend(left)
+    return plan
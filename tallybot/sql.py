@@ -0,0 +1,200 @@
+"""Direct SQL access to memory tables.
+
+membank covers getting and putting single items. Functions here cover
+what it does not: bulk reads and bulk writes within one database
+transaction.
+
+>>> table = get_table(memory, memories.Transaction)
+>>> items = select(memory, memories.Transaction, table.c.id.in_(ids))
+>>> put_many(memory, items)
+"""
+
+import dataclasses
+
+import membank
+import sqlalchemy as sa
+
+
+CHUNK_SIZE = 500  # Stay below SQLite limit of variables in one statement
+
+
+def get_table_name(cls):
+    """Return membank table name of a dataclass."""
+    return cls.__name__.lower()
+
+
+def get_table(memory, cls):
+    """Return SQL table of dataclass or None if table does not exist."""
+    try:
+        # pylint: disable=protected-access
+        return memory._get_sql_table(get_table_name(cls))
+    except membank.MemoryTableDoesNotExist:
+        return None
+
+
+def get_engine(memory):
+    """Return SQLAlchemy engine of memory."""
+    # pylint: disable=protected-access
+    return memory._get_engine()
+
+
+def get_key(cls):
+    """Return name of key field of dataclass or None if there is none."""
+    for field in dataclasses.fields(cls):
+        if "key" in field.metadata:
+            return field.name
+    return None
+
+
+def get_index_name(table, names):
+    """Return name of index on table columns."""
+    return "_".join(("ix", table.name) + tuple(names))
+
+
+def create_indexes(memory, cls, indexes):
+    """Create missing indexes on dataclass table.
+
+    Indexes is a list of column name tuples. Nothing is done if table
+    does not exist yet.
+    """
+    table = get_table(memory, cls)
+    if table is None:
+        return
+    with get_engine(memory).begin() as conn:
+        for names in indexes:
+            name = get_index_name(table, names)
+            columns = ", ".join(f'"{i}"' for i in names)
+            stmt = f'CREATE INDEX IF NOT EXISTS "{name}"'
+            stmt += f' ON "{table.name}" ({columns})'
+            conn.execute(sa.text(stmt))
+
+
+def get_chunks(items, size=CHUNK_SIZE):
+    """Split sequence of items into lists of at most size items."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def get_statement(table, names, *where, order_by=(), limit=None):
+    """Return select statement of named columns matching where clauses."""
+    stmt = table.select().with_only_columns(*(table.c[i] for i in names))
+    for clause in where:
+        stmt = stmt.where(clause)
+    if order_by:
+        stmt = stmt.order_by(*order_by)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def select_rows(memory, cls, names, *where, order_by=(), limit=None):
+    """Return list of row tuples with named columns matching where clauses."""
+    table = get_table(memory, cls)
+    if table is None:
+        return []
+    stmt = get_statement(table, names, *where, order_by=order_by, limit=limit)
+    with get_engine(memory).connect() as conn:
+        return [tuple(row) for row in conn.execute(stmt)]
+
+
+def select(memory, cls, *where, order_by=(), limit=None):
+    """Return list of dataclass items that match where clauses."""
+    names = [i.name for i in dataclasses.fields(cls)]
+    rows = select_rows(
+        memory, cls, names, *where, order_by=order_by, limit=limit
+    )
+    return [cls(*row) for row in rows]
+
+
+def select_keys(memory, cls, keys):
+    """Return set of keys that are already stored for dataclass."""
+    table = get_table(memory, cls)
+    if table is None:
+        return set()
+    col = table.c[get_key(cls)]
+    found = set()
+    with get_engine(memory).connect() as conn:
+        for chunk in get_chunks(set(keys)):
+            stmt = table.select().with_only_columns(col).where(col.in_(chunk))
+            found.update(i[0] for i in conn.execute(stmt))
+    return found
+
+
+def get_values(item):
+    """Return dict of column values of dataclass item."""
+    values = {}
+    for field in dataclasses.fields(item):
+        value = getattr(item, field.name)
+        if "encode" in field.metadata:
+            value = field.metadata["encode"](value)
+        values[field.name] = value
+    return values
+
+
+def put_many(memory, items, deleted=(), appended=()):
+    """Insert or update items in one database transaction.
+
+    Items with key field replace stored items with the same key, items
+    without key are always inserted. Stored items with keys of deleted
+    items are removed in the same transaction. Appended items are always
+    inserted, their integer keys renumbered in order after the largest
+    stored key read in the same transaction, so they never replace
+    stored items. If table for a dataclass does not exist yet, the
+    first item of that kind is put through membank so it creates the
+    table.
+    """
+    groups = {}
+    appends = {}
+    for item in items:
+        groups.setdefault(type(item), []).append(item)
+    for item in appended:
+        appends.setdefault(type(item), []).append(item)
+    for cls, group in [*groups.items(), *appends.items()]:
+        if get_table(memory, cls) is None:
+            memory.put(group.pop(0))
+    with get_engine(memory).begin() as conn:
+        for item in deleted:
+            table = get_table(memory, type(item))
+            key = get_key(type(item))
+            if table is not None and key:
+                col = table.c[key]
+                conn.execute(table.delete().where(col == getattr(item, key)))
+        for cls, group in groups.items():
+            if not group:
+                continue
+            table = get_table(memory, cls)
+            key = get_key(cls)
+            if key:
+                group = list({getattr(i, key): i for i in group}.values())
+                col = table.c[key]
+                for chunk in get_chunks(getattr(i, key) for i in group):
+                    conn.execute(table.delete().where(col.in_(chunk)))
+            conn.execute(table.insert(), [get_values(i) for i in group])
+        for cls, group in appends.items():
+            if not group:
+                continue
+            table = get_table(memory, cls)
+            key = get_key(cls)
+            last = conn.execute(sa.select(sa.func.max(table.c[key]))).scalar()
+            for position, item in enumerate(group, (last or 0) + 1):
+                setattr(item, key, position)
+            conn.execute(table.insert(), [get_values(i) for i in group])
+
+
+def replace(memory, cls, items, *where):
+    """Delete stored items matching where clauses and insert items.
+
+    Both happen in one database transaction.
+    """
+    table = get_table(memory, cls)
+    if table is None:
+        put_many(memory, items)
+        return
+    with get_engine(memory).begin() as conn:
+        stmt = table.delete()
+        for clause in where:
+            stmt = stmt.where(clause)
+        conn.execute(stmt)
+        if items:
+            conn.execute(table.insert(), [get_values(i) for i in items])
@@ -0,0 +1,147 @@
+"""Financial statements rolled up over chart of accounts.
+
+Accounts are 4 digit codes that roll up to their 2 digit group and 1
+digit class. Classes 1 to 5 make balance sheet and classes 6 to 8 make
+profit and loss. Leaf sums are closing balances of accounts read from
+BalanceIndex in one query per date.
+
+Account tree is built from chart of accounts once and cached until
+account table is written to.
+
+>>> get_balance_sheet(memory, date)
+>>> get_profit_loss(memory, start, end)
+"""
+
+import datetime
+import weakref
+
+import sqlalchemy as sa
+
+from . import sql
+from .memories import Account, BalanceIndex, Money, StatementRow
+
+ACCOUNT_CLASSES = {
+    "1": "Long-term investments",
+    "2": "Current assets",
+    "3": "Equity",
+    "4": "Provisions",
+    "5": "Creditors",
+    "6": "Income",
+    "7": "Expenses",
+    "8": "Other income, expenses and taxes",
+}
+BALANCE_SHEET_CLASSES = ("1", "2", "3", "4", "5")
+PROFIT_LOSS_CLASSES = ("6", "7", "8")
+
+trees = weakref.WeakKeyDictionary()  # engine: AccountTree
+
+
+class AccountTree:
+    """Chart of accounts as tree of classes, groups and accounts."""
+
+    def __init__(self, accounts):
+        """Build tree from dict of account names by account ids."""
+        self.names = dict(ACCOUNT_CLASSES)
+        self.children = {}
+        for account, name in accounts.items():
+            self.names[str(account)] = name
+            self.add(str(account))
+
+    def add(self, code):
+        """Add account code under its group and class."""
+        for parent, child in ((None, code[:1]), (code[:1], code[:2])):
+            self.children.setdefault(parent, set()).add(child)
+        self.children.setdefault(code[:2], set()).add(code)
+
+    def get_rows(self, balances, classes):
+        """Return StatementRow list of classes with balances rolled up.
+
+        Balances are dict by account ids. Nodes without balance are left
+        out and children follow their parent in code order.
+        """
+        sums = {}
+        for account, balance in balances.items():
+            code = str(account)
+            self.add(code)
+            for node in (code[:1], code[:2], code):
+                sums[node] = sums.get(node, 0) + balance
+        rows = []
+        stack = sorted((i for i in classes if i in sums), reverse=True)
+        while stack:
+            code = stack.pop()
+            name = self.names.get(code, "")
+            rows.append(StatementRow(code, name, Money(sums[code])))
+            children = self.children.get(code, ()) if len(code) < 4 else ()
+            stack += sorted((i for i in children if i in sums), reverse=True)
+        return rows
+
+
+def forget(conn, clause, *args):
+    """Drop cached tree when account table is written to."""
+    table = getattr(clause, "table", None)
+    if getattr(clause, "is_dml", False) and table is not None:
+        if table.name == sql.get_table_name(Account):
+            trees.pop(conn.engine, None)
+
+
+def get_tree(memory):
+    """Return AccountTree of memory, building it if needed."""
+    engine = sql.get_engine(memory)
+    if engine not in trees:
+        if not sa.event.contains(engine, "after_execute", forget):
+            sa.event.listen(engine, "after_execute", forget)
+        names = dict(sql.select_rows(memory, Account, ("id", "name")))
+        trees[engine] = AccountTree(names)
+    return trees[engine]
+
+
+def get_result(balances):
+    """Return total of profit and loss accounts in balances."""
+    return sum(
+        v for i, v in balances.items() if str(i)[:1] in PROFIT_LOSS_CLASSES
+    )
+
+
+def get_balance_sheet(memory, date):
+    """Return StatementRow list of balance sheet at the end of date.
+
+    Profit and loss accounts are not closed into equity, so classes are
+    followed by result of previous years and result of the period since
+    start of year of date. Results are credit negative as equity, so
+    class rows and results sum up to zero.
+    """
+    index = BalanceIndex(memory)
+    balances = index.get_balances(date)
+    start = datetime.date(date.year, 1, 1) - datetime.timedelta(days=1)
+    previous = get_result(index.get_balances(start))
+    rows = get_tree(memory).get_rows(balances, BALANCE_SHEET_CLASSES)
+    if previous:
+        rows.append(
+            StatementRow("", "Result of previous years", Money(previous))
+        )
+    result = get_result(balances) - previous
+    rows.append(StatementRow("", "Result of the period", Money(result)))
+    return rows
+
+
+def get_profit_loss(memory, start, end):
+    """Return StatementRow list of profit and loss in [start, end).
+
+    Movements of accounts are differences of closing balances at the
+    ends of the day before start and the day before end. Last row is
+    profit, so income is shown negative as it is credited.
+    """
+    index = BalanceIndex(memory)
+    day = datetime.timedelta(days=1)
+    balances = index.get_balances(end - day)
+    for account, balance in index.get_balances(start - day).items():
+        balances[account] = balances.get(account, 0) - balance
+    balances = {
+        i: v
+        for i, v in balances.items()
+        if v and str(i)[:1] in PROFIT_LOSS_CLASSES
+    }
+    rows = get_tree(memory).get_rows(balances, PROFIT_LOSS_CLASSES)
+    profit = -sum(i.balance for i in rows if len(i.code) == 1)
+    rows.append(StatementRow("", "Profit", Money(profit)))
+    return rows
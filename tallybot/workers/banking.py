@@ -1,9 +1,11 @@
 """Agent for invoice booking."""
 
+import datetime
 import logging
 
 from agents import Agent, RunContextWrapper, function_tool
 
+from .. import exchange
 from ..brain import do_task
 from . import base, master
 
@@ -27,6 +29,27 @@ async def do_seb_statement_import(
     return msg
 
 
+@function_tool
+@base.catch_exceptions
+@base.assert_single_attachment("text/csv")
+async def do_upwork_statement_import(
+    w: RunContextWrapper[base.TallybotContext],
+) -> str:
+    """Import Upwork statement into accounting system."""
+    store = exchange.RateStore(
+        w.context.memory, w.context.conf.get("exchange_rates")
+    )
+    await store.aload(datetime.date.today() - datetime.timedelta(days=1))
+    msg, fbytes, fname = do_task(
+        w.context.conf,
+        w.context.memory,
+        "do_upwork_statement",
+        [],
+        w.context.get_attachment().binary,
+    )
+    return msg
+
+
 bank_statement_clerk = Agent(
     name="bank_statement_clerk",
     instructions=(
@@ -37,6 +60,7 @@ bank_statement_clerk = Agent(
     ),
     tools=[
         do_seb_statement_import,
+        do_upwork_statement_import,
         master.get_user_last_attachment,
     ],
 )
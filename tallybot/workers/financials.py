@@ -60,18 +60,30 @@ async def list_transactions(
     year: Optional[str] = None,
     month: Optional[str] = None,
     partner: Optional[str] = None,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
 ) -> str:
     """List booked accounting transactions in ledger.
 
-    For performance reasons transaction list is capped to 100 entries.
-    It is also advisable to filter by optional parameters to avoid too
-    long lists.
+    Transactions are listed in pages ordered by date, 100 entries per
+    page unless page_size is given. If there are more transactions, the
+    list ends with next_cursor, pass it as cursor with the same filters
+    to get the next page. It is also advisable to filter by optional
+    parameters to avoid too long lists.
     """
     msg, _, _ = do_task(
         w.context.conf,
         w.context.memory,
         "do_list_transactions",
-        [{"year": year, "partner": partner, "month": month}],
+        [
+            {
+                "year": year,
+                "partner": partner,
+                "month": month,
+                "page_size": page_size,
+                "cursor": cursor,
+            }
+        ],
     )
     return msg
 
@@ -106,12 +118,13 @@ async def list_discrepancies(
 async def recalculate_partner_discrepancies(
     w: RunContextWrapper[TallybotContext],
     year: str,
-    partner: str,
+    partner: Optional[str] = None,
 ) -> str:
-    """Recalculate discrepancies for given year and partner.
+    """Recalculate discrepancies for given year, with optional partner filter.
 
     Only needed if there was some corrections made that did not apply
-    afterwards in the discrepancy report.
+    afterwards in the discrepancy report. Without partner all partners
+    of the year are recalculated at once.
     """
     msg, _, _ = do_task(
         w.context.conf,
@@ -153,3 +166,32 @@ async def send_discrepancy_report(
             )
         )
     return msg
+
+
+@function_tool
+async def send_trial_balance(
+    w: RunContextWrapper[TallybotContext], date: Optional[str] = None
+) -> str:
+    """Send trial balance to user and return it as text.
+
+    Trial balance lists closing balances of all accounts at the end of
+    date in format YYYY-MM-DD. If date is not provided, today is used.
+    """
+    msg, fbytes, fname = do_task(
+        w.context.conf,
+        w.context.memory,
+        "do_get_trial_balance",
+        [{"date": date}],
+    )
+    if fbytes:
+        w.context.message_parts.append(
+            MessagePart(
+                text="Trial Balance.",
+                binary=fbytes,
+                filename=fname,
+                media_type=(
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                ),
+            )
+        )
+    return msg
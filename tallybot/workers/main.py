@@ -22,6 +22,7 @@ tallybot = Agent(
         payables.do_private_expense_booking,
         payables.do_private_income_booking,
         banking.do_seb_statement_import,
+        banking.do_upwork_statement_import,
         master.do_register_partner,
         master.do_update_partner,
         master.get_user_last_attachment,
@@ -30,6 +31,7 @@ tallybot = Agent(
         financials.recalculate_partner_discrepancies,
         financials.list_transactions,
         financials.send_ledger_report,
+        financials.send_trial_balance,
         journal.ledger_correction_clerk.as_tool(
             tool_name="ledger_correction_clerk",
             tool_description="You can correct ledger entries with this tool.",
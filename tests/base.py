@@ -16,7 +16,7 @@ import uuid
 import membank
 import openpyxl
 
-from tallybot import brain, plugin
+from tallybot import brain, migrations, plugin
 from zoozl.chatbot import api, InterfaceRoot, Package
 from zoozl.tests import TestEmailbot
 
@@ -190,7 +190,9 @@ def construct_memory(conf: dict):
             f"tallybot config must contain database: {conf['tallybot']}"
         )
     db_path = f'sqlite://{conf["tallybot"]["database"]}'
-    return membank.LoadMemory(db_path)
+    memory = membank.LoadMemory(db_path)
+    migrations.migrate(memory)
+    return memory
 
 
 def add_memory(setup):
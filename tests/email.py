@@ -56,7 +56,7 @@ class PrivateIncome(base.AbstractEmailInterfaceTest):
         booking = memory.get(
             memory.transaction.debit == 2310,
             memory.transaction.credit == 8900,
-            memory.transaction.debit_amount == self.val,
+            memory.transaction.debit_amount == memories.Money(self.val),
         )
         self.assertEqual(1, len(booking), list(booking))
 
@@ -145,7 +145,7 @@ class Assets(base.AbstractEmailInterfaceTest):
         books = mem.get(mem.transaction.debit == 7420)
         self.assertEqual(len(books), 23)
         for i in books:
-            self.assertEqual(round(val / 23, 2), i.debit_amount)
+            self.assertEqual(memories.Money(val / 23), i.debit_amount)
 
 
 class SocialReport(base.AbstractEmailInterfaceTest):
@@ -297,7 +297,7 @@ class ManageTrips(base.AbstractEmailInterfaceTest):
         self.assertEqual(len(fuel_booking), 4)
         for booking in fuel_booking:
             self.assertEqual(booking.credit, 5310)
-            self.assertEqual(booking.debit_amount, round(100 * split, 2))
+            self.assertEqual(booking.debit_amount, memories.Money(100 * split))
             self.assertEqual(booking.debit_amount, booking.credit_amount)
 
     def test_fuel_expense_force(self):
@@ -468,13 +468,13 @@ class Expenses(base.AbstractEmailInterfaceTest):
         memory = membank.LoadMemory(self.conf["db_path"])
         expense = memory.get(
             memory.transaction.debit == 8900,
-            memory.transaction.debit_amount == val,
+            memory.transaction.debit_amount == memories.Money(val),
         )
         self.assertEqual(1, len(expense), list(expense))
         expense = expense[0]
         self.assertEqual(expense.credit, 5310)
         self.assertEqual(expense.date, date)
-        self.assertEqual(expense.debit_amount, val)
+        self.assertEqual(expense.debit_amount, memories.Money(val))
         self.assertEqual(expense.debit_amount, expense.credit_amount)
 
     def test(self):
@@ -495,7 +495,7 @@ class Expenses(base.AbstractEmailInterfaceTest):
         expense = memory.get(memory.transaction.debit == 7120)
         self.assertEqual(1, len(expense))
         expense = expense[0]
-        self.assertEqual(val, expense.debit_amount)
+        self.assertEqual(memories.Money(val), expense.debit_amount)
         self.assertEqual(expense.debit_amount, expense.credit_amount)
         self.assertEqual(0, expense.credit_stack)
         self.assertEqual(ref, expense.reference)
@@ -521,17 +521,19 @@ class Expenses(base.AbstractEmailInterfaceTest):
         self.assertEqual(2, len(expense))
         self.assertIn(8900, [i.debit for i in expense])
         self.assertIn(7120, [i.debit for i in expense])
-        self.assertEqual(val, round(sum(i.debit_amount for i in expense), 2))
+        self.assertEqual(
+            memories.Money(val), sum(i.debit_amount for i in expense)
+        )
         for i in expense:
             self.assertEqual(0, i.credit_stack)
             self.assertEqual(i.debit_amount, i.credit_amount)
             if i.debit == 8900:
                 self.assertEqual(
-                    round(val * (100 - split) / 100, 2), i.debit_amount
+                    memories.Money(val * (100 - split) / 100), i.debit_amount
                 )
             else:
                 self.assertEqual(
-                    round(val * (split) / 100, 2), i.debit_amount, i
+                    memories.Money(val * (split) / 100), i.debit_amount, i
                 )
             self.assertEqual(5310, i.credit, i)
 
@@ -738,8 +740,12 @@ class SebStatement(base.AbstractEmailInterfaceTest):
             self.assertIn(test[0], transactions)
             expect = transactions[test[0]]
             self.assertIn(test[1], expect.comment, expect)
-            self.assertEqual(test[2], expect.debit_amount, expect)
-            self.assertEqual(test[2], expect.credit_amount, expect)
+            self.assertEqual(
+                memories.Money(test[2]), expect.debit_amount, expect
+            )
+            self.assertEqual(
+                memories.Money(test[2]), expect.credit_amount, expect
+            )
             self.assertEqual(test[3], expect.debit, expect)
             self.assertEqual("EUR", expect.debit_currency, expect)
             self.assertEqual("EUR", expect.credit_currency, expect)
@@ -793,13 +799,13 @@ class UpworkInvoices(base.AbstractEmailInterfaceTest):
         self.assertEqual(book_test.debit, 7170)
         self.assertEqual(book_test.credit, 5310)
         self.assertEqual("T460107076", book_test.reference)
-        nodes = memory.get(memory.node.transaction == book_test.id)
-        self.assertEqual(len(nodes), 2)
-        for node in nodes:
-            if node.account == 5310:
-                self.assertEqual(node.closing, -9.07)
-            else:
-                self.assertEqual(node.closing, 92.57)
+        index = memories.BalanceIndex(memory)
+        self.assertEqual(
+            index.get_balance(5310, book_test.date), memories.Money(-9.07)
+        )
+        self.assertEqual(
+            index.get_balance(7170, book_test.date), memories.Money(92.57)
+        )
 
 
 class Accounts(base.AbstractEmailInterfaceTest):
@@ -872,10 +878,12 @@ class UpworkStatement(base.AbstractEmailInterfaceTest):
         exch_book = memory.get(memory.transaction.credit == 8150)
         self.assertEqual(len(exch_book), 1)
         exch_book = exch_book[0]
-        self.assertEqual(exch_book.debit_amount, 19.56, exch_book)
+        self.assertEqual(
+            exch_book.debit_amount, memories.Money(19.56), exch_book
+        )
         book = memory.get(
             memory.transaction.debit == 7170,
             memory.transaction.credit == 2670,
-            memory.transaction.debit_amount == round(exch_loss, 2),
+            memory.transaction.debit_amount == exch_loss,
         )
         self.assertEqual(len(book), 1, book)
@@ -0,0 +1,75 @@
+"""Stand-in of ECB exchange rate feeds served from local files.
+
+`Server` serves files of a directory over HTTP with ETag and
+Last-Modified validators and records requested paths with response
+status codes.
+"""
+
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    """File handler that answers If-None-Match with ETag of file."""
+
+    def __init__(self, *args, requests, **kargs):
+        """Initialise with list that records requests."""
+        self.requests = requests
+        super().__init__(*args, **kargs)
+
+    def send_head(self):
+        """Send 304 if ETag matches, otherwise file with its ETag."""
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            with open(path, "rb") as file:
+                etag = '"' + hashlib.md5(file.read()).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return None
+            self.etag = etag
+        return super().send_head()
+
+    def end_headers(self):
+        """Add ETag of served file."""
+        if getattr(self, "etag", None):
+            self.send_header("ETag", self.etag)
+            self.etag = None
+        super().end_headers()
+
+    def log_request(self, code="-", size="-"):
+        """Record request instead of logging it."""
+        self.requests.append((self.path, int(code)))
+
+
+class Server:
+    """Local HTTP server of ECB feed files in directory.
+
+    >>> with Server(path) as server:
+    ...     exchange.ECBProvider(server.url)
+    """
+
+    def __init__(self, directory):
+        """Initialise with directory of feed files."""
+        self.requests = []
+        handler = functools.partial(
+            Handler, requests=self.requests, directory=directory
+        )
+        self.httpd = http.server.ThreadingHTTPServer(("localhost", 0), handler)
+        self.url = f"http://localhost:{self.httpd.server_port}/"
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_msg, exc_tr):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
@@ -0,0 +1 @@
+"""Unit tests, structure mirrors tallybot package."""
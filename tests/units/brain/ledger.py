@@ -0,0 +1,162 @@
+"""Ledger commands unittests."""
+
+import datetime
+
+from tallybot import memories, sql
+from tallybot.brain import ledger
+from tallybot.memories import Money
+from tests.units.memories import TestCase
+
+
+class RecalculateOutstanding(TestCase):
+    """Test recalculation of outstanding stacks."""
+
+    def test_all_partners(self):
+        """Stacks of all partners are matched first in first out."""
+        for partner in ("a", "b"):
+            for day, amount in ((1, 10), (2, 20), (3, 30)):
+                date = datetime.date(2023, 1, day)
+                ref = f"{partner}{day}"
+                self.booking("out_invoice", date, amount, ref, partner).save()
+        date = datetime.date(2023, 2, 1)
+        self.booking("seb-income", date, 35, "ap", "a").save()
+        self.booking("seb-income", date, 70, "bp", "b").save()
+        for item in self.memory.get("transaction"):
+            item.debit_stack = item.debit_amount
+            item.credit_stack = item.credit_amount
+            self.memory.put(item)
+        changed = ledger.recalculate_outstanding(self.memory, 2023)
+        self.assertEqual(len(changed), 8)
+        stacks = {i.reference: (i.debit_stack, i.credit_stack) for i in changed}
+        self.assertEqual(stacks["a1"][0], 0)
+        self.assertEqual(stacks["a2"][0], 0)
+        self.assertEqual(stacks["a3"][0], Money.from_units("25"))
+        self.assertEqual(stacks["b3"][0], 0)
+        self.assertEqual(stacks["ap"][1], 0)
+        self.assertEqual(stacks["bp"][1], Money.from_units("10"))
+
+    def test_no_changes(self):
+        """Already consistent bookings are not returned."""
+        date = datetime.date(2023, 1, 1)
+        self.booking("out_invoice", date, 10, "i").save()
+        self.booking("seb-income", date, 4, "p").save()
+        self.assertEqual(ledger.recalculate_outstanding(self.memory, 2023), [])
+        self.assertEqual(ledger.recalculate_outstanding(self.memory, 2022), [])
+
+
+class TransactionPage(TestCase):
+    """Test keyset pagination of transactions."""
+
+    def test_pages(self):
+        """Pages cover all transactions once in date and id order."""
+        for day in (3, 1, 2, 2, 2):
+            self.book("seb-expense", datetime.date(2023, 1, day), day)
+        start = datetime.date(2023, 1, 1)
+        end = datetime.date(2023, 2, 1)
+        items, cursor = [], None
+        for _ in range(3):
+            page, cursor = ledger.get_transaction_page(
+                self.memory, start, end, cursor=cursor, size=2
+            )
+            items += page
+        self.assertIsNone(cursor)
+        self.assertEqual(len(items), 5)
+        keys = [(i.date, i.id) for i in items]
+        self.assertEqual(keys, sorted(set(keys)))
+
+    def test_invalid_cursor(self):
+        """Cursor that is not a page token is refused."""
+        self.book("seb-expense", datetime.date(2023, 1, 1), 1)
+        date = datetime.date(2023, 1, 1)
+        with self.assertRaises(RuntimeWarning):
+            ledger.get_transaction_page(self.memory, date, date, cursor="x")
+
+
+class ReplayEvents(TestCase):
+    """Test rebuild of ledger from event log."""
+
+    def test_replay(self):
+        """Replay restores stacks, balances and car mileage."""
+        jan = datetime.date(2023, 1, 1)
+        feb = datetime.date(2023, 2, 1)
+        self.booking("out_invoice", jan, 100, "i").save()
+        self.booking("seb-income", feb, 30, "p").save()
+        self.booking("seb-expense", feb, 5, "x").save()
+        removed = self.memory.get.transaction(reference="x")
+        self.memory.delete(removed)
+        memories.EventLog(self.memory).append("delete", [removed])
+        trip = memories.Trip("2023-01-05", "a - b", "visit", 12)
+        memories.EventLog(self.memory).append("trip", [trip, trip])
+        for item in self.memory.get("transaction"):
+            item.debit_stack = item.credit_stack = 0
+            self.memory.put(item)
+        self.memory.put(memories.Balance(2310, 0, 999))
+        ledger.replay_events(self.memory)
+        invoice = self.memory.get.transaction(reference="i")
+        self.assertEqual(invoice.debit_stack, Money.from_units("70"))
+        self.assertIsNone(self.memory.get.transaction(reference="x"))
+        index = memories.BalanceIndex(self.memory)
+        self.assertEqual(index.get_balance(2310, feb), Money.from_units("70"))
+        self.assertEqual(len(self.memory.get("trip")), 2)
+        car = self.memory.get.car(id=memories.DEFAULT_CAR_PLATE)
+        self.assertEqual(car.total_km, 24)
+
+    def test_reconciled(self):
+        """Replay keeps stacks matched by reconciliation."""
+        jan = datetime.date(2023, 1, 1)
+        self.booking("out_invoice", jan, 100, "i1").save()
+        self.booking("out_invoice", jan, 30, "i2").save()
+        writer = memories.LedgerWriter(self.memory, reconcile=True)
+        writer.add(
+            self.booking("seb-income", datetime.date(2023, 2, 1), 30, "p")
+        )
+        writer.commit()
+        ledger.replay_events(self.memory)
+        stacks = {
+            i.reference: i.debit_stack for i in self.memory.get("transaction")
+        }
+        self.assertEqual(stacks["i1"], Money.from_units("100"))
+        self.assertEqual(stacks["i2"], 0)
+
+    def test_unlogged(self):
+        """Replay is refused if it would drop transactions not logged."""
+        self.booking("out_invoice", datetime.date(2023, 1, 1), 10, "i").save()
+        item = self.memory.get.transaction(reference="i")
+        item.id = "unlogged"
+        self.memory.put(item)
+        with self.assertRaises(RuntimeWarning):
+            ledger.replay_events(self.memory)
+        self.assertIsNotNone(self.memory.get.transaction(id="unlogged"))
+
+    def test_concurrent(self):
+        """Writers numbering events alike never overwrite the log."""
+        date = datetime.date(2023, 1, 1)
+        writer = memories.LedgerWriter(self.memory)
+        writer.add(self.booking("seb-expense", date, 1, "a"))
+        writer.commit()
+        self.booking("seb-expense", date, 2, "b").save()
+        writer.add(self.booking("seb-expense", date, 3, "c"))
+        writer.commit()
+        events = list(memories.EventLog(self.memory).stream())
+        refs = [i.item["reference"] for i in events]
+        self.assertEqual(refs, ["a", "b", "c"])
+        logs = [memories.EventLog(self.memory) for _ in range(2)]
+        items = [[memories.Sequences(i, 1)] for i in ("x", "y")]
+        events = [i.get_events("sequence", j) for i, j in zip(logs, items)]
+        for item, event in zip(items, events):
+            sql.put_many(self.memory, item, appended=event)
+        positions = [i.position for i in logs[0].stream()]
+        self.assertEqual(positions, [1, 2, 3, 4, 5])
+        relations = [i.item.get("relation") for i in logs[0].stream()]
+        self.assertEqual(relations[3:], ["x", "y"])
+
+    def test_log_order(self):
+        """Events stream in order of positions across reads."""
+        log = memories.EventLog(self.memory)
+        items = [memories.Sequences(str(i), i) for i in range(5)]
+        log.append("sequence", items)
+        log.append("sequence", items[:1])
+        positions = [i.position for i in log.stream(size=2)]
+        self.assertEqual(positions, list(range(1, 7)))
+        with self.assertRaises(ValueError):
+            log.get_events("unknown", items)
@@ -0,0 +1,131 @@
+"""Report commands unittests."""
+
+import dataclasses as data
+import datetime
+
+from tallybot import memories
+from tallybot.brain import do_task, reports
+from tests.units.memories import TestCase
+
+
+class TrialBalance(TestCase):
+    """Test trial balance report."""
+
+    def test_struct(self):
+        """Trial balance lists named accounts with balances in units."""
+        self.memory.put(memories.Account(7640, "Bank fees"))
+        self.book("seb-commission", datetime.date(2023, 1, 10), 12.5)
+        data = {"date": "2023-01-31"}
+        r_struct = reports.get_trial_balance_struct(data, self.memory)
+        rows = [(i.account, i.name, i.balance) for i in r_struct.items]
+        self.assertEqual(rows, [(5310, "", -12.5), (7640, "Bank fees", 12.5)])
+        r_struct = reports.get_trial_balance_struct({}, self.memory)
+        self.assertEqual(len(r_struct.items), 2)
+
+    def test_corrections(self):
+        """Deleted, updated and manual transactions show in balances."""
+        conf = self.config["tallybot"]
+        date = datetime.date(2023, 1, 10)
+        deleted = self.book("seb-commission", date, 10)
+        updated = self.book("seb-commission", date, 10)
+        do_task(
+            conf, self.memory, "do_delete_transaction", [{"id": deleted.id}]
+        )
+        update = {"id": updated.id, "debit_amount": 4, "credit": 2620}
+        do_task(conf, self.memory, "do_update_transaction", [update])
+        manual = {
+            "date": "2023-01-10",
+            "reference": "m",
+            "source": "",
+            "comment": "",
+            "debit_amount": 5,
+            "debit": 7640,
+            "credit": 5310,
+        }
+        do_task(conf, self.memory, "do_transaction", [manual])
+        data = {"date": "2023-01-31"}
+        r_struct = reports.get_trial_balance_struct(data, self.memory)
+        rows = [(i.account, i.balance) for i in r_struct.items]
+        self.assertEqual(rows, [(2620, -4.0), (5310, -5.0), (7640, 9.0)])
+
+
+class VatReport(TestCase):
+    """Test VAT report."""
+
+    def test_rows(self):
+        """VAT lines are summed by month and partner country."""
+        address = memories.Address(country="LV")
+        partner = memories.Partner("client", address_id=address.id)
+        self.memory.put(address)
+        self.memory.put(partner)
+        jan = datetime.date(2023, 1, 10)
+        feb = datetime.date(2023, 2, 10)
+        self.booking("out_invoice", jan, 100, "a", partner.id).save()
+        self.booking("out_invoice", jan, 50, "b", partner.id).save()
+        self.booking("out_invoice", feb, 30, "c", "unknown").save()
+        self.booking("vat", feb, 7, "d", "unknown").save()
+        self.booking("seb-expense", feb, 9, "e").save()
+        start = datetime.date(2023, 1, 1)
+        end = datetime.date(2023, 4, 1)
+        r_struct = memories.ReportStruct(
+            "vat", reports.get_vat_rows(self.memory, start, end), self.memory
+        )
+        rows = [(i.period, i.country, i.sales, i.vat) for i in r_struct.items]
+        self.assertEqual(
+            rows, [("2023-01", "LV", 150.0, 0), ("2023-02", "", 30.0, 7.0)]
+        )
+        start, end = reports.get_current_quarter(datetime.date(2023, 11, 5))
+        self.assertEqual((start.month, end), (10, datetime.date(2024, 1, 1)))
+
+    def test_year(self):
+        """Year filter without quarter or month covers the whole year."""
+        for month in (1, 7, 12):
+            date = datetime.date(2023, month, 10)
+            self.booking("out_invoice", date, 10, str(month)).save()
+        self.booking("out_invoice", datetime.date(2024, 1, 10), 10, "n").save()
+        data = {"filter_by_year": "2023"}
+        msg, _, _ = do_task(
+            self.config["tallybot"], self.memory, "do_get_vat_report", [data]
+        )
+        periods = [i.split(";")[0] for i in msg.splitlines()[1:]]
+        self.assertEqual(periods, ["2023-01", "2023-07", "2023-12"])
+
+
+class AgingReport(TestCase):
+    """Test aging of open items."""
+
+    def test_buckets(self):
+        """Open stacks are bucketed by days overdue after terms."""
+        partner = memories.Partner("client", terms="10")
+        self.memory.put(partner)
+        date = datetime.date(2023, 6, 30)
+        for days, amount in ((5, 1), (45, 2), (70, 3), (75, 4), (200, 5)):
+            invoice_date = date - datetime.timedelta(days=days)
+            ref = str(days)
+            self.booking(
+                "out_invoice", invoice_date, amount, ref, partner.id
+            ).save()
+        self.booking("seb-income", date, 0.5, "p", partner.id).save()
+        self.booking("inc_invoice", date, 7, "s", "supplier").save()
+        rows = reports.get_aging_rows(self.memory, date)
+        rows = [(i.partner, i.account, *data.astuple(i)[2:]) for i in rows]
+        self.assertEqual(
+            rows,
+            [
+                (partner.id, 2310, 100, 500, 350, 500, 1450),
+                ("supplier", 5310, -700, 0, 0, 0, -700),
+            ],
+        )
+        r_struct = memories.ReportStruct(
+            "aging", reports.get_aging_rows(self.memory, date), self.memory
+        )
+        self.assertEqual(r_struct.items[0].partner, "client")
+        self.assertEqual(r_struct.items[0].total, 14.5)
+
+    def test_closed_year(self):
+        """Open items of closed fiscal years are aged too."""
+        self.booking("out_invoice", datetime.date(2021, 12, 1), 3, "a").save()
+        self.booking("out_invoice", datetime.date(2022, 1, 1), 2, "b").save()
+        self.close_year(2021)
+        rows = reports.get_aging_rows(self.memory, datetime.date(2022, 6, 1))
+        self.assertEqual([i.total for i in rows], [500])
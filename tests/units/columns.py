@@ -0,0 +1,63 @@
+"""Columnar ledger cache unittests."""
+
+import datetime
+
+from tallybot import columns
+from tallybot.memories import Money
+from tests.units.memories import TestCase
+
+
+class LedgerColumns(TestCase):
+    """Test columnar cache of transactions."""
+
+    def test_filters(self):
+        """Mask selects transactions by date interval and partner."""
+        jan = datetime.date(2023, 1, 10)
+        feb = datetime.date(2023, 2, 10)
+        self.booking("out_invoice", jan, 10.1, "a", "a").save()
+        self.booking("out_invoice", feb, 20.2, "b", "b").save()
+        self.booking("out_invoice", feb, 30.3, "c", "a").save()
+        ledger = columns.get_year(self.memory, 2023)
+        self.assertEqual(len(ledger), 3)
+        mask = ledger.get_mask(feb, partner="a")
+        self.assertEqual([i.reference for i in ledger.get_items(mask)], ["c"])
+        mask = ledger.get_mask(jan, feb)
+        self.assertEqual(
+            ledger.get_sum("debit_amount", mask), Money.from_units("10.10")
+        )
+        self.assertFalse(ledger.get_mask(partner="x").any())
+        self.assertEqual(len(columns.get_year(self.memory, 2022)), 0)
+
+    def test_invalidate(self):
+        """Cached year is dropped when transactions change."""
+        date = datetime.date(2023, 1, 10)
+        self.booking("out_invoice", date, 10, "a").save()
+        ledger = columns.get_year(self.memory, 2023)
+        self.assertIs(ledger, columns.get_year(self.memory, 2023))
+        item = ledger.get_items(ledger.get_mask())[0]
+        item.comment = "changed"
+        self.memory.put(item)
+        ledger = columns.get_year(self.memory, 2023)
+        self.assertEqual(ledger.items[0].comment, "changed")
+        self.booking("out_invoice", date, 20, "b").save()
+        ledger = columns.get_year(self.memory, 2023)
+        self.assertEqual(len(ledger), 2)
+        self.memory.delete(item)
+        self.assertEqual(len(columns.get_year(self.memory, 2023)), 1)
+
+    def test_income_expense(self):
+        """Income and expense are summed by month across years."""
+        self.booking("out_invoice", datetime.date(2022, 12, 5), 100, "a").save()
+        self.booking("out_invoice", datetime.date(2023, 2, 5), 50, "b").save()
+        self.booking("seb-commission", datetime.date(2023, 2, 6), 5, "c").save()
+        self.booking("seb-expense", datetime.date(2023, 2, 7), 9, "d").save()
+        self.booking("fx-profit", datetime.date(2023, 2, 8), 2, "e").save()
+        start = datetime.date(2022, 12, 1)
+        end = datetime.date(2023, 3, 1)
+        rows = columns.get_income_expense(self.memory, start, end)
+        self.assertEqual([i[0].month for i in rows], [12, 1, 2])
+        self.assertEqual(rows[0][1:], (Money.from_units("100"), 0))
+        self.assertEqual(rows[1][1:], (0, 0))
+        self.assertEqual(
+            rows[2][1:], (Money.from_units("52"), Money.from_units("5"))
+        )
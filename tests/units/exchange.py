@@ -0,0 +1,265 @@
+"""Exchange rates unittests."""
+
+import asyncio
+import datetime
+import os
+import tempfile
+
+import sqlalchemy as sa
+
+from tallybot import exchange, memories, sql
+from tests.simulators import ecb
+from tests.units.memories import TestCase
+
+ECB_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<message:GenericData
+    xmlns:message="http://www.SDMX.org/resources/SDMXML/schemas/v2_0/message"
+    xmlns="http://www.ecb.europa.eu/vocabulary/stats/exr/1">
+<message:DataSet>
+<Series FREQ="D" CURRENCY="USD" CURRENCY_DENOM="EUR">
+<Obs TIME_PERIOD="2023-01-06" OBS_VALUE="1.0500" />
+<Obs TIME_PERIOD="2023-01-02" OBS_VALUE="1.0683" />
+<Obs TIME_PERIOD="2023-01-09" OBS_VALUE="1.0734" />
+</Series>
+<Series FREQ="D" CURRENCY="GBP" CURRENCY_DENOM="EUR">
+<Obs TIME_PERIOD="2023-01-02" OBS_VALUE="0.8870" />
+</Series>
+</message:DataSet>
+</message:GenericData>
+"""
+ECB_DAILY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01"
+    xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+<Cube>
+<Cube time="2023-01-10">
+<Cube currency="USD" rate="1.0737"/>
+<Cube currency="GBP" rate="0.8843"/>
+</Cube>
+</Cube>
+</gesmes:Envelope>
+"""
+ECB_90D = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01"
+    xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+<Cube>
+<Cube time="2023-01-10"><Cube currency="USD" rate="1.0737"/></Cube>
+<Cube time="2023-01-09"><Cube currency="USD" rate="1.0734"/></Cube>
+<Cube time="2023-01-06"><Cube currency="USD" rate="1.0500"/></Cube>
+<Cube time="2023-01-05"><Cube currency="USD" rate="1.0600"/></Cube>
+</Cube>
+</gesmes:Envelope>
+"""
+ECB_FILES = {
+    "eurofxref-sdmx.xml": ECB_XML,
+    "eurofxref-daily.xml": ECB_DAILY,
+    "eurofxref-hist-90d.xml": ECB_90D,
+}
+ECB_CSV = """Date,USD,JPY,GBP,
+2022-12-30,1.0666,140.66,0.88693,
+2022-12-29,1.0649,141.44,N/A,
+"""
+
+
+class ECBTestCase(TestCase):
+    """Base class of tests with ECB feeds served from local files."""
+
+    def setUp(self):
+        """Serve ECB feeds and local ECB csv from temporary directory."""
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in ECB_FILES.items():
+            self.write(name, content)
+        self.path = self.write("eurofxref-hist.csv", ECB_CSV.encode())
+        self.server = ecb.Server(self.directory.name).__enter__()
+        self.provider = exchange.PROVIDER
+        exchange.PROVIDER = exchange.ECBProvider(self.server.url)
+
+    def tearDown(self):
+        """Stop serving ECB feeds."""
+        exchange.PROVIDER = self.provider
+        self.server.__exit__(None, None, None)
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        """Write file into served directory and return its path."""
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as file:
+            file.write(content)
+        return path
+
+
+class Rates(ECBTestCase):
+    """Test lookups in parsed ECB history."""
+
+    def setUp(self):
+        """Seed store from local xml."""
+        super().setUp()
+        path = self.write("history.xml", ECB_XML)
+        self.store = exchange.RateStore(self.memory, path)
+
+    def test_rate(self):
+        """Rate is the last one published before date."""
+        days = {3: 1.0683, 7: 1.05, 9: 1.05, 10: 1.0734, 31: 1.0737}
+        for day, rate in days.items():
+            date = datetime.date(2023, 1, day)
+            self.assertEqual(self.store.get_rate("USD", date), rate)
+        self.assertEqual(
+            self.store.get_rate("GBP", datetime.date(2023, 1, 9)), 0.887
+        )
+        with self.assertRaises(RuntimeError):
+            self.store.get_rate("USD", datetime.date(2023, 1, 2))
+
+    def test_rates(self):
+        """Rates of many dates are the same as of one date."""
+        dates = [datetime.date(2023, 1, i) for i in (10, 3, 8, 3)]
+        rates = self.store.get_rates([(i, "USD") for i in dates])
+        self.assertEqual(rates, [self.store.get_rate("USD", i) for i in dates])
+        with self.assertRaises(RuntimeError):
+            self.store.get_rates([(datetime.date(2022, 12, 1), "USD")])
+
+
+class ECBProvider(ECBTestCase):
+    """Test downloads of ECB feeds."""
+
+    def test_feeds(self):
+        """Shortest feed with all days since last known rate is used."""
+        provider = exchange.PROVIDER
+        rates = provider.get_rates()
+        self.assertEqual(len(rates["USD"][0]), 3)
+        rates = provider.get_rates(datetime.date(2023, 1, 9))
+        self.assertEqual(list(rates["USD"][1]), [1.0737])
+        rates = provider.get_rates(datetime.date(2023, 1, 6))
+        self.assertEqual(len(rates["USD"][0]), 4)
+        paths = [i[0] for i in self.server.requests]
+        expected = [
+            "/eurofxref-sdmx.xml",
+            "/eurofxref-daily.xml",
+            "/eurofxref-daily.xml",
+            "/eurofxref-hist-90d.xml",
+        ]
+        self.assertEqual(paths, expected)
+
+    def test_conditional(self):
+        """Feed not changed since last download is not downloaded."""
+        provider = exchange.PROVIDER
+        rates = provider.fetch("eurofxref-daily.xml")
+        self.assertIs(provider.fetch("eurofxref-daily.xml"), rates)
+        self.write("eurofxref-daily.xml", ECB_DAILY.replace(b"1.07", b"1.08"))
+        rates = provider.fetch("eurofxref-daily.xml")
+        self.assertEqual(list(rates["USD"][1]), [1.0837])
+        codes = [i[1] for i in self.server.requests]
+        self.assertEqual(codes, [200, 304, 200])
+
+    def test_abstract(self):
+        """Provider without get_rates can not be created."""
+        with self.assertRaises(TypeError):
+            exchange.RateProvider()
+
+
+class RateStore(ECBTestCase):
+    """Test rates kept in memory database."""
+
+    def count_queries(self):
+        """Return list of queries on rate table run from now on."""
+        queries = []
+        engine = sql.get_engine(self.memory)
+
+        def count(conn, cursor, statement, *args):
+            """Count queries on rate table."""
+            if "FROM rate" in statement:
+                queries.append(statement)
+
+        sa.event.listen(engine, "before_cursor_execute", count)
+        self.addCleanup(sa.event.remove, engine, "before_cursor_execute", count)
+        return queries
+
+    def test_seed(self):
+        """Rates of seeded dates are read without download."""
+        store = exchange.RateStore(self.memory, self.path)
+        date = datetime.date(2022, 12, 31)
+        self.assertEqual(store.get_rate("USD", date), 1.0666)
+        self.assertEqual(store.get_rate("GBP", date), 0.88693)
+        date = datetime.date(2022, 12, 30)
+        self.assertEqual(store.get_rate("USD", date), 1.0649)
+        with self.assertRaises(RuntimeError):
+            store.get_rate("GBP", date)
+        self.assertEqual(len(self.memory.get("rate")), 5)
+        self.assertEqual(self.server.requests, [])
+
+    def test_download(self):
+        """Rates published since seeding are added from download."""
+        store = exchange.RateStore(self.memory, self.path)
+        store.get_rate("USD", datetime.date(2022, 12, 31))
+        date = datetime.date(2023, 1, 10)
+        self.assertEqual(store.get_rate("USD", date), 1.0734)
+        self.assertEqual(store.get_until(), datetime.date.today())
+        paths = [i[0] for i in self.server.requests]
+        self.assertEqual(paths[-1], "/eurofxref-sdmx.xml")
+        rates = self.memory.get("rate")
+        self.assertEqual(len(rates), 9)
+        self.assertEqual(len({(i.currency, i.date) for i in rates}), 9)
+        store = exchange.RateStore(self.memory)
+        date = datetime.date(2023, 1, 4)
+        self.assertEqual(store.get_rate("USD", date), 1.0683)
+        self.assertIsInstance(self.memory.get("rate")[0], memories.Rate)
+
+    def test_batch(self):
+        """Rates of many dates and currencies are read in one query."""
+        store = exchange.RateStore(self.memory, self.path)
+        store.get_rate("USD", datetime.date(2022, 12, 31))
+        pairs = [
+            (datetime.date(2022, 12, 31), "USD"),
+            (datetime.datetime(2022, 12, 30, 15), "JPY"),
+            (datetime.date(2022, 12, 30), "USD"),
+        ] * 700
+        queries = self.count_queries()
+        rates = store.get_rates(pairs)
+        self.assertEqual(rates, [1.0666, 141.44, 1.0649] * 700)
+        self.assertEqual(len(queries), 1)
+
+    def test_empty(self):
+        """Lookup without any stored rate is refused as rate not found."""
+
+        class Empty(exchange.RateProvider):
+            """Provider of empty feed."""
+
+            def get_rates(self, since=None):
+                """Return no rates."""
+                return {}
+
+        store = exchange.RateStore(self.memory, provider=Empty())
+        date = datetime.date(2023, 1, 10)
+        with self.assertRaises(RuntimeError):
+            store.get_rate("USD", date)
+        with self.assertRaises(RuntimeError):
+            store.get_rates([(date, "USD")])
+
+    def test_cache(self):
+        """History is read once until rates are stored until later date."""
+        store = exchange.RateStore(self.memory, self.path)
+        date = datetime.date(2022, 12, 31)
+        store.get_rate("USD", date)
+        queries = self.count_queries()
+        store = exchange.RateStore(self.memory, self.path)
+        self.assertEqual(store.get_rate("USD", date), 1.0666)
+        self.assertEqual(store.get_rates([(date, "USD")]), [1.0666])
+        self.assertEqual(queries, [])
+        date = datetime.date(2023, 1, 10)
+        self.assertEqual(store.get_rate("USD", date), 1.0734)
+        self.assertTrue(queries)
+
+    def test_aload(self):
+        """Concurrent loads in event loop share one download."""
+        stores = [exchange.RateStore(self.memory) for _ in range(3)]
+        date = datetime.date(2023, 1, 10)
+
+        async def load():
+            """Load all stores at once."""
+            await asyncio.gather(*(i.aload(date) for i in stores))
+
+        asyncio.run(load())
+        self.assertEqual(self.server.requests, [("/eurofxref-sdmx.xml", 200)])
+        self.assertEqual(exchange.SERVICE.flights, {})
+        self.assertEqual(len(self.memory.get("rate")), 4)
+        self.assertEqual(stores[0].get_rate("USD", date), 1.0734)
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,33 @@
+"""Handlers unittests."""
+
+import types
+import unittest
+
+from tallybot import handlers
+
+
+class ExcelGenerator(unittest.TestCase):
+    """Test Excel report generation."""
+
+    def test_rows(self):
+        """Header, attribute names and items land in their cells."""
+        attrs = [f"field{i}" for i in range(30)]
+        items = [
+            types.SimpleNamespace(**{j: i for j in attrs}) for i in range(3)
+        ]
+        r_struct = types.SimpleNamespace(
+            title="report",
+            header=[("B2", "title"), ("AD1", "wide"), ("A2", "first")],
+            start=4,
+            attrs=attrs,
+            items=items,
+        )
+        binary = handlers.ExcelGenerator(r_struct).binary()
+        sheet = handlers.get_excel(binary)["report"]
+        self.assertEqual(sheet["A2"].value, "first")
+        self.assertEqual(sheet["B2"].value, "title")
+        self.assertEqual(sheet["AD1"].value, "wide")
+        self.assertIsNone(sheet["A3"].value)
+        self.assertEqual(sheet["AD4"].value, "Field29")
+        self.assertEqual(sheet["AD7"].value, 2)
+        self.assertEqual(sheet.max_row, 7)
@@ -0,0 +1,317 @@
+"""Memories unittests."""
+
+import dataclasses as data
+import datetime
+import decimal
+import hashlib
+import os
+import stat
+
+import numpy as np
+import sqlalchemy as sa
+
+from tallybot import memories, sql
+from tests import base
+
+
+class TestCase(base.TestCase):
+    """Base class for memories tests."""
+
+    @base.add_clean_memory
+    @base.add_memory
+    def setUp(self):
+        """Enable memory interface."""
+
+    def booking(self, record, date, amount, reference, partner="partner"):
+        """Return booking of record type."""
+        return memories.Booking(
+            record,
+            self.memory,
+            date=date,
+            reference=reference,
+            source="",
+            comment="",
+            debit_amount=amount,
+            partner=partner,
+        )
+
+    def book(self, record, date, amount):
+        """Save booking of record type."""
+        booking = self.booking(record, date, amount, base.unique_name(self))
+        booking.save()
+        return booking.transaction
+
+    def close_year(self, year):
+        """Close fiscal year and remove its file after test."""
+        years = memories.FiscalYears(self.memory)
+        self.addCleanup(os.remove, years.get_path(year))
+        years.close(year)
+        return years
+
+
+class BalanceIndex(TestCase):
+    """Test running balances of accounts."""
+
+    def test_back_dated(self):
+        """Booking in the past corrects balances of later dates."""
+        jan = datetime.date(2023, 1, 10)
+        feb = datetime.date(2023, 2, 10)
+        mar = datetime.date(2023, 3, 10)
+        self.book("seb-commission", mar, 30)
+        self.book("seb-commission", jan, 10)
+        self.book("seb-commission", feb, 20.05)
+        index = memories.BalanceIndex(self.memory)
+        self.assertEqual(
+            index.get_balance(7640, jan), memories.Money.from_units("10")
+        )
+        self.assertEqual(
+            index.get_balance(7640, feb), memories.Money.from_units("30.05")
+        )
+        self.assertEqual(
+            index.get_balance(7640, mar), memories.Money.from_units("60.05")
+        )
+        self.assertEqual(
+            index.get_balance(5310, mar), memories.Money.from_units("-60.05")
+        )
+        day_before = jan - datetime.timedelta(days=1)
+        self.assertEqual(index.get_balance(7640, day_before), 0)
+
+    def test_same_day(self):
+        """Balance at the end of day includes all bookings of that day."""
+        day = datetime.date(2023, 2, 14)
+        for _ in range(3):
+            self.book("seb-commission", day, 1.1)
+        index = memories.BalanceIndex(self.memory)
+        self.assertEqual(
+            index.get_balance(7640, day), memories.Money.from_units("3.3")
+        )
+
+    def test_rebuild(self):
+        """Rebuilt balances match balances kept on booking."""
+        dates = [datetime.date(2023, i, 28 - i) for i in (5, 1, 3, 12, 2)]
+        for i, date in enumerate(dates):
+            self.book("seb-commission", date, 10 + i)
+            self.book("seb-expense", date, 7.5)
+        index = memories.BalanceIndex(self.memory)
+        expected = {
+            (acc, date): index.get_balance(acc, date)
+            for acc in (7640, 5310, 2620)
+            for date in dates
+        }
+        self.memory.put(memories.Balance(5310, 5000, 999))
+        index.rebuild([5310])
+        index.rebuild()
+        for (acc, date), balance in expected.items():
+            self.assertEqual(index.get_balance(acc, date), balance)
+
+    def test_balances(self):
+        """Balances of all accounts are read at once."""
+        jan = datetime.date(2023, 1, 10)
+        feb = datetime.date(2023, 2, 10)
+        self.book("seb-commission", jan, 10)
+        self.book("seb-expense", feb, 4)
+        index = memories.BalanceIndex(self.memory)
+        balances = index.get_balances(feb)
+        self.assertEqual(list(balances), [2620, 5310, 7640])
+        for account, balance in balances.items():
+            self.assertEqual(index.get_balance(account, feb), balance)
+        self.assertEqual(sum(balances.values()), 0)
+        self.assertEqual(index.get_balances(jan), {5310: -1000, 7640: 1000})
+
+    def test_delete_update(self):
+        """Deleted, updated and manual transactions move balances."""
+        date = datetime.date(2023, 1, 10)
+        item = self.book("seb-commission", date, 10)
+        memories.put_transactions(self.memory, deleted=[item])
+        index = memories.BalanceIndex(self.memory)
+        self.assertEqual(index.get_balances(date), {})
+        item = self.book("seb-commission", date, 10)
+        item.debit_amount = memories.Money.from_units("4")
+        item.credit = 2620
+        amount = memories.Money.from_units("5")
+        manual = memories.Transaction(
+            date, "m", "", "", amount, debit=7640, credit=5310
+        )
+        memories.put_transactions(self.memory, [item, manual])
+        expected = {2620: -400, 5310: -500, 7640: 900}
+        self.assertEqual(index.get_balances(date), expected)
+        kinds = [i.kind for i in memories.EventLog(self.memory).stream()]
+        self.assertEqual(kinds[1:3], ["delete", "transaction"])
+        self.assertEqual(len(kinds), 5)
+
+
+class LedgerWriter(TestCase):
+    """Test saving many bookings at once."""
+
+    def test_match(self):
+        """Bookings are matched in date order regardless of add order."""
+        jan = datetime.date(2023, 1, 1)
+        feb = datetime.date(2023, 2, 1)
+        writer = memories.LedgerWriter(self.memory)
+        writer.add(self.booking("seb-income", feb, 30, "p"))
+        writer.add(self.booking("out_invoice", jan, 100, "i"))
+        writer.commit()
+        invoice = self.memory.get.transaction(reference="i")
+        payment = self.memory.get.transaction(reference="p")
+        self.assertEqual(invoice.debit_stack, memories.Money.from_units("70"))
+        self.assertEqual(payment.credit_stack, 0)
+        writer.add(self.booking("seb-income", feb, 80, "x"))
+        writer.commit()
+        invoice = self.memory.get.transaction(reference="i")
+        payment = self.memory.get.transaction(reference="x")
+        self.assertEqual(invoice.debit_stack, 0)
+        self.assertEqual(payment.credit_stack, memories.Money.from_units("10"))
+
+    def test_duplicates(self):
+        """Duplicates within batch and in memory are not saved."""
+        date = datetime.date(2023, 1, 1)
+        writer = memories.LedgerWriter(self.memory)
+        for _ in range(2):
+            writer.add(self.booking("seb-expense", date, 10, "a"))
+        writer.commit()
+        writer.add(self.booking("seb-expense", date, 10, "a"))
+        writer.add(self.booking("seb-expense", date, 10, "b"))
+        writer.commit()
+        self.assertEqual(len(self.memory.get("transaction")), 2)
+        index = memories.BalanceIndex(self.memory)
+        self.assertEqual(
+            index.get_balance(2620, date), memories.Money.from_units("-20")
+        )
+
+
+class OpenItems(TestCase):
+    """Test index of open items."""
+
+    def test_fifo(self):
+        """Payment consumes open invoices from the oldest one."""
+        writer = memories.LedgerWriter(self.memory)
+        for day, amount in ((3, 30), (1, 10), (2, 20)):
+            date = datetime.date(2023, 1, day)
+            writer.add(self.booking("out_invoice", date, amount, str(day)))
+        writer.commit()
+        open_items = memories.OpenItems(self.memory)
+        payment = self.booking("seb-income", datetime.date(2023, 2, 1), 35, "p")
+        open_items.load([payment.transaction])
+        queue = open_items.get("debit", 2310, "EUR", "partner", 2023)
+        self.assertEqual([i.reference for i in queue], ["1", "2", "3"])
+        payment.match_deals(open_items)
+        self.assertEqual([i.reference for i in queue], ["3"])
+        self.assertEqual(queue[0].debit_stack, memories.Money.from_units("25"))
+        self.assertEqual(len(payment.matched_deals), 3)
+        self.assertEqual(payment.transaction.credit_stack, 0)
+
+
+class FiscalYears(TestCase):
+    """Test ledger partitioned by fiscal year."""
+
+    def test_close(self):
+        """Closed year is read from its own file and cannot be booked."""
+        dates = [datetime.date(2021, 3, 1), datetime.date(2022, 3, 1)]
+        for date in dates:
+            self.book("seb-commission", date, 10)
+        index = memories.BalanceIndex(self.memory)
+        balance = index.get_balance(7640, dates[1])
+        years = self.close_year(2021)
+        self.assertEqual(len(self.memory.get("transaction")), 1)
+        table = years.get_table(2021)
+        items = years.select(2021, table.c.debit == 7640)
+        self.assertEqual([i.date for i in items], dates[:1])
+        path = years.get_path(2021)
+        writable = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        self.assertFalse(os.stat(path).st_mode & writable)
+        if os.geteuid() != 0:
+            self.assertFalse(os.access(path, os.W_OK))
+        self.assertEqual(len(years.select_all()), 2)
+        index.rebuild()
+        self.assertEqual(index.get_balance(7640, dates[1]), balance)
+        with self.assertRaises(RuntimeWarning):
+            self.book("seb-commission", dates[0], 10)
+        manual = memories.Transaction(dates[0], "m", "", "", 1)
+        with self.assertRaises(RuntimeWarning):
+            memories.put_transactions(self.memory, [manual])
+        item = self.memory.get.transaction(date=dates[1])
+        item.date = dates[0]
+        with self.assertRaises(RuntimeWarning):
+            memories.put_transactions(self.memory, [item])
+        with self.assertRaises(RuntimeWarning):
+            years.close(datetime.date.today().year)
+
+
+class Money(TestCase):
+    """Test money kept in integer cents."""
+
+    def test_create(self):
+        """Integers are cents, units and other cents are explicit."""
+        self.assertEqual(memories.Money(1250), 1250)
+        self.assertEqual(memories.Money(np.int64(1250)), 1250)
+        self.assertEqual(memories.Money.from_cents(1250.0), 1250)
+        self.assertEqual(memories.Money.from_units(12.5), 1250)
+        self.assertEqual(memories.Money.from_units("0.125"), 13)
+        self.assertEqual(memories.Money.from_units(0.1 + 0.2), 30)
+        self.assertEqual(memories.Money.from_units(3), 300)
+        self.assertEqual(str(memories.Money(-5)), "-0.05")
+        for value in (12.5, "12.50", decimal.Decimal("12.5"), np.float64(1)):
+            with self.assertRaises(TypeError):
+                memories.Money(value)
+        with self.assertRaises(ValueError):
+            memories.Money.from_cents(12.5)
+
+    def test_transaction(self):
+        """Transaction amounts are Money of stored cents only."""
+        date = datetime.date(2023, 1, 1)
+        amount = memories.Money.from_units(10.1)
+        item = memories.Transaction(date, "", "", "", amount, rate=2)
+        self.assertEqual(item.debit_amount, 1010)
+        self.assertEqual(item.deal_value, 505)
+        self.assertIsInstance(item.credit_stack, memories.Money)
+        item = memories.Transaction(**data.asdict(item))
+        self.assertEqual(item.credit_stack, 1010)
+        with self.assertRaises(TypeError):
+            memories.Transaction(date, "", "", "", 10.1)
+
+    def test_legacy_id(self):
+        """Ids hash amounts as given like earlier versions did."""
+        date = datetime.date(2023, 1, 1)
+        for amount, text in ((15, "15"), (15.0, "15.0"), (12.5, "12.5")):
+            booking = self.booking("seb-commission", date, amount, "r")
+            key = f"20230101r{text}EUREUR76405310".encode()
+            self.assertEqual(
+                booking.transaction.id, hashlib.sha1(key).hexdigest()
+            )
+        amount = memories.Money.from_units(15)
+        item = memories.Transaction(
+            date, "r", "", "", amount, 0, "", 7640, 5310
+        )
+        key = b"20230101r15.0EUREUR76405310"
+        self.assertEqual(item.id, hashlib.sha1(key).hexdigest())
+
+
+class ReportStruct(TestCase):
+    """Test report structures."""
+
+    def test_partner_names(self):
+        """Partner names of all rows are read in one query."""
+        date = datetime.date(2023, 1, 1)
+        partners = [memories.Partner(f"name{i}") for i in range(3)]
+        items = []
+        for i, partner in enumerate(partners * 2):
+            self.memory.put(partner)
+            items.append(
+                self.booking("seb-expense", date, 1, str(i), partner.id)
+            )
+        items = [i.transaction for i in items]
+        items.append(self.booking("seb-expense", date, 1, "x", "").transaction)
+        queries = []
+        engine = sql.get_engine(self.memory)
+
+        def count(conn, cursor, statement, *args):
+            """Count queries on partner table."""
+            if "FROM partner" in statement:
+                queries.append(statement)
+
+        sa.event.listen(engine, "before_cursor_execute", count)
+        report = memories.ReportStruct("ledger", items, self.memory)
+        sa.event.remove(engine, "before_cursor_execute", count)
+        self.assertEqual(len(queries), 1)
+        names = [i.partner for i in report.items]
+        self.assertEqual(names, ["name0", "name1", "name2"] * 2 + [""])
@@ -0,0 +1,74 @@
+"""Migrations unittests."""
+
+import dataclasses as data
+import datetime
+import os
+import tempfile
+import unittest
+
+import membank
+
+from tallybot import memories, migrations
+from tallybot.brain import reports
+
+
+@data.dataclass
+class Transaction:
+    """Transaction as stored by versions before integer cents."""
+
+    date: datetime.date
+    reference: str
+    source: str
+    comment: str
+    debit_amount: float
+    credit_amount: float = 0
+    partner: str = ""
+    debit: int = 0
+    credit: int = 0
+    deal_value: float = 0
+    rate: float = 1
+    debit_currency: str = "EUR"
+    credit_currency: str = "EUR"
+    debit_stack: float = -1
+    credit_stack: float = -1
+    id: str = data.field(default=None, metadata={"key": True})
+
+
+class Migrate(unittest.TestCase):
+    """Test upgrade of databases of earlier versions."""
+
+    def setUp(self):
+        """Store ledger of earlier version in temporary database."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        path = os.path.join(self.directory.name, "baseline.db")
+        self.url = f"sqlite://{path}"
+        memory = membank.LoadMemory(self.url)
+        date = datetime.date(2023, 1, 10)
+        for i, (debit, credit, amount) in enumerate(
+            ((7640, 2620, 4.5), (2620, 5310, 10.0))
+        ):
+            item = Transaction(date, f"r{i}", "", "", amount, amount)
+            item.debit, item.credit, item.id = debit, credit, f"id{i}"
+            item.deal_value = item.debit_stack = item.credit_stack = amount
+            memory.put(item)
+
+    def get_trial_balance(self, memory):
+        """Return (account, balance) rows of trial balance of 2023."""
+        struct = reports.get_trial_balance_struct(
+            {"date": "2023-12-31"}, memory
+        )
+        return [(i.account, i.balance) for i in struct.items]
+
+    def test_balance_index(self):
+        """Balances of upgraded ledger are built once and kept current."""
+        memory = membank.LoadMemory(self.url)
+        migrations.migrate(memory)
+        expected = [(2620, 5.5), (5310, -10.0), (7640, 4.5)]
+        self.assertEqual(self.get_trial_balance(memory), expected)
+        migrations.migrate(memory)
+        item = memory.get.transaction(id="id0")
+        item.debit_amount = memories.Money.from_units("5")
+        memories.put_transactions(memory, [item])
+        expected = [(2620, 5.0), (5310, -10.0), (7640, 5.0)]
+        self.assertEqual(self.get_trial_balance(memory), expected)
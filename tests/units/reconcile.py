@@ -0,0 +1,120 @@
+"""Reconciliation unittests."""
+
+import datetime
+import types
+
+from tallybot import memories, reconcile
+from tallybot.memories import Money
+from tests.units.memories import TestCase
+
+
+class MatchPlan(TestCase):
+    """Test statement lines joined with open items."""
+
+    def setUp(self):
+        """Save open invoices of partner."""
+        super().setUp()
+        writer = memories.LedgerWriter(self.memory)
+        invoices = (
+            (1, 100, "i1", "consulting acme january"),
+            (2, 50, "i2", "design acme"),
+            (3, 70, "i3", "hosting acme march"),
+        )
+        for day, amount, ref, comment in invoices:
+            date = datetime.date(2023, 1, day)
+            booking = self.booking("out_invoice", date, amount, ref)
+            booking.transaction.comment = comment
+            writer.add(booking)
+        writer.commit()
+
+    def pay(self, amount, reference, comment=""):
+        """Return payment booking of partner."""
+        booking = self.booking(
+            "seb-income", datetime.date(2023, 2, 1), amount, reference
+        )
+        booking.transaction.comment = comment
+        return booking
+
+    def get_stacks(self):
+        """Return open stacks of invoices by references."""
+        items = self.memory.get("transaction")
+        return {i.reference: i.debit_stack for i in items if i.debit == 2310}
+
+    def test_join(self):
+        """Lines match by amount, reference and text before FIFO."""
+        writer = memories.LedgerWriter(self.memory, reconcile=True)
+        writer.add(self.pay(50, "p1"))
+        writer.add(self.pay(20, "p2", "payment for i3."))
+        writer.add(self.pay(10, "p3"))
+        writer.commit()
+        expected = {
+            "i1": Money.from_units("90"),
+            "i2": 0,
+            "i3": Money.from_units("50"),
+        }
+        self.assertEqual(self.get_stacks(), expected)
+        writer.add(self.pay(5, "p4", "Hosting for ACME March"))
+        writer.commit()
+        self.assertEqual(self.get_stacks()["i3"], Money.from_units("45"))
+
+    def test_subset(self):
+        """Line paying several invoices matches those adding up to it."""
+        writer = memories.LedgerWriter(self.memory, reconcile=True)
+        writer.add(self.pay(170, "p1"))
+        writer.commit()
+        expected = {"i1": 0, "i2": Money.from_units("50"), "i3": 0}
+        self.assertEqual(self.get_stacks(), expected)
+
+    def test_subset_budget(self):
+        """Lines past total search time are left to later stages."""
+        lines = [types.SimpleNamespace(credit_stack=Money.from_units("170"))]
+        items = self.memory.get("transaction")
+        budget = reconcile.SUBSET_TOTAL_SECONDS
+        self.assertEqual(len(reconcile.join_subsets(lines, items, "debit")), 2)
+        reconcile.SUBSET_TOTAL_SECONDS = 0
+        try:
+            self.assertEqual(reconcile.join_subsets(lines, items, "debit"), [])
+        finally:
+            reconcile.SUBSET_TOTAL_SECONDS = budget
+
+    def test_fifo(self):
+        """Without reconcile lines match oldest invoices first."""
+        writer = memories.LedgerWriter(self.memory)
+        writer.add(self.pay(50, "p1"))
+        writer.commit()
+        expected = {
+            "i1": Money.from_units("50"),
+            "i2": Money.from_units("50"),
+            "i3": Money.from_units("70"),
+        }
+        self.assertEqual(self.get_stacks(), expected)
+
+
+class Subset(TestCase):
+    """Test search of amounts summing to target."""
+
+    def test_subset(self):
+        """Subset is found within limits of search."""
+        amounts = [700, 300, 1250, 45, 990, 5]
+        subset = reconcile.get_subset(amounts, 1300, float("inf"))
+        self.assertEqual(sum(amounts[i] for i in subset), 1300)
+        self.assertIsNone(reconcile.get_subset(amounts, 1, float("inf")))
+        self.assertIsNone(reconcile.get_subset(amounts, 1300, 0))
+        amounts = list(range(100, 140))
+        subset = reconcile.get_subset(amounts, 2400, float("inf"))
+        self.assertEqual(sum(amounts[i] for i in subset), 2400)
+
+
+class Fuzzy(TestCase):
+    """Test pairs of lines and items by text scores."""
+
+    def test_taken(self):
+        """Pairs after cells of taken rows and columns are still found."""
+        lines = ["acme web hosting", "acme hosting"]
+        items = ["acme web hosting", "acme hosting plan"]
+        pairs = reconcile.join_fuzzy(
+            [types.SimpleNamespace(reference=i, comment="") for i in lines],
+            [types.SimpleNamespace(reference=i, comment="") for i in items],
+        )
+        pairs = [(i.reference, j.reference) for i, j in pairs]
+        self.assertEqual(pairs, list(zip(lines, items)))
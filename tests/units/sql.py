@@ -0,0 +1,70 @@
+"""SQL access unittests."""
+
+import datetime
+
+import sqlalchemy as sa
+
+from tallybot import memories, migrations, sql
+from tests.units.memories import TestCase
+
+
+class Indexes(TestCase):
+    """Test that lookups use secondary indexes."""
+
+    def setUp(self):
+        """Store items in every indexed table."""
+        super().setUp()
+        date = datetime.date(2023, 1, 1)
+        self.book("seb-commission", date, 10)
+        self.memory.put(memories.Trip(date, "trip", "", 10))
+        self.memory.put(memories.PartnerIndex("text", "id"))
+        self.memory.put(memories.Currency(date, "USD", 1.1))
+        migrations.migrate(self.memory)
+
+    def get_plan(self, query):
+        """Return query plan details of SQL query."""
+        with sql.get_engine(self.memory).connect() as conn:
+            rows = conn.execute(sa.text("EXPLAIN QUERY PLAN " + query))
+            return " ".join(i[-1] for i in rows)
+
+    def assert_index(self, table, names, where):
+        """Assert that query with where clause on table uses index."""
+        plan = self.get_plan(f'SELECT * FROM "{table}" WHERE {where}')
+        index = sql.get_index_name(sa.table(table), names)
+        self.assertIn(f"USING INDEX {index}", plan)
+
+    def test_transaction(self):
+        """Ledger lookups use transaction indexes."""
+        dates = "date >= '2023-01-01' AND date < '2024-01-01'"
+        self.assert_index(
+            "transaction", ("partner", "date"), f"partner = 'a' AND {dates}"
+        )
+        self.assert_index(
+            "transaction", ("debit", "date"), f"debit = 2310 AND {dates}"
+        )
+        self.assert_index(
+            "transaction", ("credit", "date"), f"credit = 2310 AND {dates}"
+        )
+        self.assert_index(
+            "transaction",
+            ("credit", "credit_currency", "credit_stack"),
+            "credit = 6110 AND credit_currency = 'USD' AND credit_stack > 0",
+        )
+
+    def test_other(self):
+        """Lookups of other memories use their indexes."""
+        self.assert_index(
+            "balance", ("account", "position"), "account IN (7640, 5310)"
+        )
+        self.assert_index(
+            "balance", ("position", "account"), "position IN (1, 2, 4)"
+        )
+        self.assert_index(
+            "trip", ("year", "month"), "year = 2023 AND month = 1"
+        )
+        self.assert_index("partnerindex", ("text",), "text = 'text'")
+        self.assert_index(
+            "currency",
+            ("currency", "date"),
+            "currency = 'USD' AND date = '2023-01-01'",
+        )
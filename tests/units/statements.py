@@ -0,0 +1,61 @@
+"""Financial statements unittests."""
+
+import datetime
+
+from tallybot import memories, statements
+from tallybot.memories import Money
+from tests.units.memories import TestCase
+
+
+class Statements(TestCase):
+    """Test statements rolled up over account tree."""
+
+    def test_profit_loss(self):
+        """Accounts roll up to groups and classes within period."""
+        self.memory.put(memories.Account(7640, "Bank fees"))
+        self.book("seb-commission", datetime.date(2022, 12, 10), 1)
+        self.book("seb-commission", datetime.date(2023, 1, 10), 2)
+        self.book("upwork-commission", datetime.date(2023, 2, 10), 3)
+        self.book("private-income", datetime.date(2023, 3, 10), 10)
+        start = datetime.date(2023, 1, 1)
+        end = datetime.date(2024, 1, 1)
+        rows = statements.get_profit_loss(self.memory, start, end)
+        rows = [(i.code, i.name, i.balance) for i in rows]
+        expected = [
+            ("7", "Expenses", Money.from_units("5")),
+            ("71", "", Money.from_units("3")),
+            ("7170", "", Money.from_units("3")),
+            ("76", "", Money.from_units("2")),
+            ("7640", "Bank fees", Money.from_units("2")),
+            ("8", "Other income, expenses and taxes", Money.from_units("-10")),
+            ("89", "", Money.from_units("-10")),
+            ("8900", "", Money.from_units("-10")),
+            ("", "Profit", Money.from_units("5")),
+        ]
+        self.assertEqual(rows, expected)
+
+    def test_balance_sheet(self):
+        """Balance sheet has classes 1 to 5 and names of new accounts."""
+        date = datetime.date(2023, 1, 10)
+        self.book("out_invoice", date, 10)
+        rows = statements.get_balance_sheet(self.memory, date)
+        self.assertEqual([i.code for i in rows], ["2", "23", "2310", ""])
+        self.memory.put(memories.Account(2310, "Receivables"))
+        rows = statements.get_balance_sheet(self.memory, date)
+        self.assertEqual(rows[2].name, "Receivables")
+
+    def test_balanced(self):
+        """Assets equal liabilities, equity and results of years."""
+        self.book("out_invoice", datetime.date(2022, 12, 10), 7)
+        self.book("out_invoice", datetime.date(2023, 1, 10), 10)
+        self.book("seb-commission", datetime.date(2023, 2, 10), 2)
+        date = datetime.date(2023, 3, 1)
+        rows = statements.get_balance_sheet(self.memory, date)
+        results = {i.name: i.balance for i in rows if not i.code}
+        expected = {
+            "Result of previous years": Money.from_units("-7"),
+            "Result of the period": Money.from_units("-8"),
+        }
+        self.assertEqual(results, expected)
+        classes = [i.balance for i in rows if len(i.code) == 1]
+        self.assertEqual(sum(classes) + sum(results.values()), 0)